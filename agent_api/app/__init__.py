@@ -1,3 +1,9 @@
-from app.agent import root_agent
+__all__ = ["root_agent"]
 
-__all__ = ["root_agent"]
\ No newline at end of file
+
+def __getattr__(name):
+    # Build the agent pipeline on first access so importing app.* tools stays cheap
+    if name == "root_agent":
+        from app.agent import root_agent
+        return root_agent
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -15,6 +15,12 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import Config
 
+# libyaml's C emitter when available; same representers as yaml.Dumper
+try:
+    from yaml import CDumper as YamlDumper
+except ImportError:
+    from yaml import Dumper as YamlDumper
+
 logger = logging.getLogger(__name__)
 
 class BackendAPIClient:
@@ -80,7 +86,7 @@ class BackendAPIClient:
                 rules_dict['rules'].append(agent_rule)
             
             # Convert to YAML string
-            yaml_content = yaml.dump(rules_dict, default_flow_style=False, sort_keys=False)
+            yaml_content = yaml.dump(rules_dict, Dumper=YamlDumper, default_flow_style=False, sort_keys=False)
             logger.info(f"✅ Successfully fetched {len(rules_data)} rules from backend API")
             return yaml_content
             
@@ -0,0 +1,186 @@
+"""
+Batch Optimization Entry Point
+Analyzes several queries for anti-patterns with a single LLM call
+"""
+
+import os
+import json
+import asyncio
+import logging
+import uuid
+from typing import List, Dict, Any
+from google.adk.agents import LlmAgent
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from .agent import BQ_ANTI_PATTERNS
+from .bigquery_metadata import get_metadata_tool
+from .models import QueryAnalysisBatch
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of queries packed into one LLM call
+BATCH_SIZE = int(os.getenv("BATCH_OPTIMIZE_SIZE", "8"))
+BATCH_APP_NAME = "batch_optimizer"
+
+# Batch Rule Checker Agent - one prompt, one JSON array of analyses
+batch_rule_checker = LlmAgent(
+    name="batch_rule_checker",
+    model="gemini-2.5-flash",
+    description="Analyzes a batch of queries for BigQuery anti-patterns in one call",
+    instruction="""
+You are a BigQuery SQL anti-pattern checker.
+
+Analyze each of the following queries and return a JSON array of QueryAnalysis,
+one entry per query, in the same order, with "query_index" set to the query's number.
+
+Each query is followed by the table metadata fetched for it. Use the metadata
+(size_gb, row_count, partitioning, clustering, table type) to quantify impacts.
+
+Constraints (apply to every query independently):
+- Map rule severities: error → "high", warning → "medium", info → "low".
+- "rules_checked" = number of enabled rules supplied.
+- "violations_found" = count of rules that FAILED.
+- "compliance_score" = floor(100 * len(passed_rules) / rules_checked).
+- Include every non-failed rule id in "passed_rules".
+- Be precise and conservative; if unsure, do NOT invent violations.
+
+# BigQuery Anti-Patterns (from bq_anti_patterns.yaml):
+""" + BQ_ANTI_PATTERNS + "\n",
+    output_schema=QueryAnalysisBatch,
+    output_key="batch_rules_output"
+)
+
+_session_service = InMemorySessionService()
+_runner = Runner(
+    app_name=BATCH_APP_NAME,
+    agent=batch_rule_checker,
+    session_service=_session_service
+)
+
+
+async def _fetch_metadata(queries: List[str]) -> List[Dict[str, Any]]:
+    """Fetch table metadata for every query concurrently"""
+    tool = get_metadata_tool()
+    return await asyncio.gather(*(tool.aget_query_metadata(query) for query in queries))
+
+
+def _build_batch_prompt(queries: List[str], metadata: List[Dict[str, Any]]) -> str:
+    """Pack queries and their metadata into a single prompt"""
+    sections = []
+    for index, (query, query_metadata) in enumerate(zip(queries, metadata)):
+        sections.append(
+            f"## Query {index}\n{query}\n\n"
+            f"### Metadata for query {index}\n{json.dumps(query_metadata)}"
+        )
+    return "\n\n".join(sections)
+
+
+async def _analyze_chunk(queries: List[str], user_id: str) -> List[Dict[str, Any]]:
+    """Run one batch_rule_checker call for up to BATCH_SIZE queries"""
+    metadata = await _fetch_metadata(queries)
+    session = await _session_service.create_session(
+        app_name=BATCH_APP_NAME,
+        user_id=user_id,
+        session_id=str(uuid.uuid4())
+    )
+
+    message = types.Content(
+        role="user",
+        parts=[types.Part(text=_build_batch_prompt(queries, metadata))]
+    )
+    async for _ in _runner.run_async(user_id=user_id, session_id=session.id, new_message=message):
+        pass
+
+    session = await _session_service.get_session(
+        app_name=BATCH_APP_NAME,
+        user_id=user_id,
+        session_id=session.id
+    )
+    await _session_service.delete_session(
+        app_name=BATCH_APP_NAME,
+        user_id=user_id,
+        session_id=session.id
+    )
+
+    output = session.state.get("batch_rules_output") or {}
+    return _align_analyses(output.get("analyses", []), len(queries))
+
+
+def _align_analyses(analyses: List[Dict[str, Any]], query_count: int) -> List[Dict[str, Any]]:
+    """
+    Exactly one analysis per query index, in order. The model may skip, repeat or
+    misnumber entries: the first analysis for an index wins, out-of-range ones are
+    dropped and missing indices get {"query_index": ..., "error": ...}.
+    """
+    by_index = {}
+    for analysis in analyses:
+        index = analysis.get("query_index")
+        if isinstance(index, int) and 0 <= index < query_count and index not in by_index:
+            by_index[index] = analysis
+    if len(by_index) != len(analyses) or len(by_index) != query_count:
+        logger.warning("Batch returned %d analyses (%d usable) for %d queries",
+                       len(analyses), len(by_index), query_count)
+    return [
+        by_index.get(index) or {"query_index": index, "error": "No analysis returned for this query"}
+        for index in range(query_count)
+    ]
+
+
+async def batch_optimize(queries: List[str], user_id: str = "batch") -> List[Dict[str, Any]]:
+    """
+    Analyze many queries for anti-patterns, packing up to BATCH_SIZE queries per LLM call.
+
+    Args:
+        queries: SQL queries to analyze
+        user_id: ADK user id used for the temporary sessions
+
+    Returns:
+        One QueryAnalysis dict per query, in input order. Queries of a chunk whose
+        call failed get {"query_index": ..., "error": ...} instead, so one bad
+        chunk does not discard the rest of the batch.
+    """
+    chunks = [queries[i:i + BATCH_SIZE] for i in range(0, len(queries), BATCH_SIZE)]
+    logger.info("Batch analyzing %d queries in %d call(s)", len(queries), len(chunks))
+
+    results = await asyncio.gather(
+        *(_analyze_chunk(chunk, user_id) for chunk in chunks),
+        return_exceptions=True
+    )
+
+    analyses = []
+    for offset, chunk, chunk_analyses in zip(range(0, len(queries), BATCH_SIZE), chunks, results):
+        if isinstance(chunk_analyses, BaseException):
+            logger.error("Batch chunk at query %d failed: %s", offset, chunk_analyses)
+            analyses.extend(
+                {"query_index": offset + index, "error": str(chunk_analyses)}
+                for index in range(len(chunk))
+            )
+            continue
+        for analysis in chunk_analyses:
+            analysis["query_index"] = offset + analysis.get("query_index", 0)
+            analyses.append(analysis)
+    return analyses
+
+
+def _read_queries(path: str) -> List[str]:
+    """Read queries from a JSON array of strings, or from a SQL file of ';'-separated statements"""
+    with open(path) as f:
+        text = f.read()
+    try:
+        queries = json.loads(text)
+    except json.JSONDecodeError:
+        queries = text.split(";")
+    return [query.strip() for query in queries if query.strip()]
+
+
+if __name__ == "__main__":
+    # python -m app.batch queries.sql  (or a JSON array of query strings)
+    import sys
+
+    if len(sys.argv) != 2:
+        print("Usage: python -m app.batch <queries.sql | queries.json>", file=sys.stderr)
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(asyncio.run(batch_optimize(_read_queries(sys.argv[1]))), indent=2))
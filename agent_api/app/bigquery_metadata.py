@@ -4,140 +4,457 @@ BigQuery Metadata Tool for fetching actual table statistics
 
 import os
 import re
-from typing import Dict, Any, List, Optional
+import copy
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import bigquery
+from google.cloud.bigquery.retry import DEFAULT_RETRY
 from google.cloud.exceptions import NotFound
+from requests.adapters import HTTPAdapter
 import logging
 
 logger = logging.getLogger(__name__)
 
+# orjson serializes several times faster; fall back to stdlib json if the wheel is missing
+try:
+    import orjson
+    _loads = orjson.loads
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+    def _dumps_indented(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+except ImportError:
+    _loads = json.loads
+    _dumps = json.dumps
+    def _dumps_indented(obj) -> str:
+        return json.dumps(obj, indent=2)
+
+# Table metadata cache: bounded LRU, entries expire so schema/size changes are picked up
+TABLE_METADATA_CACHE_SIZE = int(os.getenv("TABLE_METADATA_CACHE_SIZE", "512"))
+TABLE_METADATA_TTL_SECONDS = float(os.getenv("TABLE_METADATA_TTL_SECONDS", "300"))
+# Optional on-disk copy of table metadata that survives restarts and is shared by workers;
+# entries are revalidated against the table's lastModifiedTime before use. Off unless a path is set
+METADATA_DISK_CACHE_PATH = os.getenv("METADATA_DISK_CACHE_PATH", "")
+BQ_META_TTL_SEC = float(os.getenv("BQ_META_TTL_SEC", "3600"))
+# Dataset-wide stats are a billed INFORMATION_SCHEMA scan; pollers get a short-lived copy
+DATASET_STATS_CACHE_SIZE = int(os.getenv("DATASET_STATS_CACHE_SIZE", "64"))
+DATASET_STATS_TTL_SECONDS = float(os.getenv("DATASET_STATS_TTL_SECONDS", "60"))
+# Single-pass SQL scanner: comments, string literals and quoted identifiers are
+# consumed whole so keywords inside them are ignored; a FROM/JOIN/INTO/UPDATE/TABLE
+# keyword captures the (dotted, possibly backticked) path that follows it
+_TABLE_REF_SCAN_RE = re.compile(r"""
+  (?=[-/'"`fjiut])  # cheap first-character filter before trying the alternatives
+  (?:
+    --[^\n]*
+  | /\*.*?(?:\*/|\Z)
+  | '(?:[^'\\]|\\.)*'?
+  | "(?:[^"\\]|\\.)*"?
+  | \b(?P<keyword>FROM|JOIN|INTO|UPDATE|TABLE)\b
+    (?:\s+|--[^\n]*|/\*.*?\*/)*
+    (?P<path>(?:`[^`]*`?|[\w*$][\w\-*$]*)(?:\.(?:`[^`]*`?|[\w*$][\w\-*$]*))*)?
+    (?P<call>\s*\()?
+  | `[^`]*`?
+  )
+""", re.VERBOSE | re.DOTALL | re.IGNORECASE)
+
+# Upper bound on concurrent table lookups for a single query
+METADATA_FETCH_WORKERS = int(os.getenv("METADATA_FETCH_WORKERS", "16"))
+# Pooled connections for the default project's client; urllib3's default of 10 is below
+# the number of concurrent lookups (metadata workers and dry runs across
+# sessions) and forces extra TLS handshakes. Every table lookup goes through that client,
+# so clients for other projects (dry runs only) keep a small pool; with the registry cap
+# below, the process holds at most BQ_HTTP_POOL_SIZE + (BQ_CLIENT_CACHE_SIZE - 1) *
+# BQ_OTHER_PROJECT_POOL_SIZE connections
+BQ_HTTP_POOL_SIZE = int(os.getenv("BQ_HTTP_POOL_SIZE", "50"))
+BQ_OTHER_PROJECT_POOL_SIZE = int(os.getenv("BQ_OTHER_PROJECT_POOL_SIZE", "10"))
+# Per-attempt HTTP timeout for tables.get, so a hung request can't block a worker thread
+METADATA_REQUEST_TIMEOUT_SECONDS = float(os.getenv("METADATA_REQUEST_TIMEOUT_SECONDS", "30"))
+# Billing guard for the INFORMATION_SCHEMA / __TABLES__ lookups (they bill 10 MB minimum)
+METADATA_QUERY_MAX_BYTES_BILLED = int(os.getenv("METADATA_QUERY_MAX_BYTES_BILLED", str(1024**3)))
+# Wildcard shard stats from __TABLES__ (INFORMATION_SCHEMA.TABLES doesn't work well with
+# some datasets like GA4 exports), aggregated in BigQuery so one row comes back
+_WILDCARD_STATS_QUERY = """
+SELECT
+    COUNT(*) as table_count,
+    SUM(row_count) as total_rows,
+    SUM(size_bytes) as total_bytes,
+    ARRAY_AGG(table_id ORDER BY table_id LIMIT 10) as tables_matched
+FROM `{project}.{dataset}.__TABLES__`
+WHERE table_id LIKE @table_pattern
+"""
+
+# GCP project ids: 6-30 chars, lowercase letters, digits and hyphens, starting with a letter
+_PROJECT_ID_RE = re.compile(r'[a-z][a-z0-9\-]{4,28}[a-z0-9]\Z')
+
+@lru_cache(maxsize=1024)
+def _parse_table_ref(table_ref: str, default_project: str) -> Tuple[str, str, str, str]:
+    """Split a table reference into (clean_ref, project, dataset, table), memoized per reference"""
+    # Canonical references have no backticks, so skip the copy for them
+    if '`' in table_ref:
+        table_ref = table_ref.replace('`', '')
+    table_ref = table_ref.strip()
+    
+    # Parse table reference
+    parts = table_ref.split('.')
+    if len(parts) == 3:
+        project, dataset, table = parts
+    elif len(parts) == 2:
+        project = default_project
+        dataset, table = parts
+    else:
+        project = default_project
+        dataset = os.getenv("BIGQUERY_DATASET", "analytics")  # Use env default
+        table = parts[0]
+    
+    # Don't modify dataset names - they can have numbers and underscores
+    # analytics_441577273 is a valid dataset name in BigQuery
+    
+    # Validate project ID once here; every lookup (wildcards included) gets its project from this parse.
+    # Looking the table up in another project could return metadata for the wrong table
+    if not _PROJECT_ID_RE.match(project):
+        raise ValueError(f"Invalid project ID {project!r} in table reference {table_ref!r}")
+    
+    return table_ref, project, dataset, table
+
+def _round_gb(size_bytes: int) -> float:
+    """Bytes to GB, rounded once for display"""
+    return round(size_bytes / (1024**3), 2)
+
+def _round_mb(size_bytes: int) -> float:
+    """Bytes to MB, rounded once for display"""
+    return round(size_bytes / (1024**2), 2)
+
+def _isoformat(value) -> Optional[str]:
+    """ISO string for an optional datetime"""
+    return value.isoformat() if value else None
+
+# Table resource fields read by _get_table_metadata_uncached and view expansion; the rest of
+# the resource (statistics, streaming buffer, encryption, ...) is skipped on the wire
+_TABLE_FIELDS_MASK = ",".join((
+    "tableReference", "type", "numBytes", "numRows", "timePartitioning", "clustering", "schema",
+    "creationTime", "lastModifiedTime", "expirationTime", "description", "labels", "location",
+    "requirePartitionFilter", "view"
+))
+
+def _get_table_light(client: bigquery.Client, table_path: str, fields: str = _TABLE_FIELDS_MASK) -> bigquery.Table:
+    """
+    client.get_table with a REST fields mask (same request path, retry, timeout and
+    NotFound behaviour). _call_api is private; tests/test_bigquery_metadata.py pins
+    this call against what get_table sends so a library upgrade can't silently break it
+    """
+    table_ref = bigquery.TableReference.from_string(table_path)
+    api_response = client._call_api(
+        DEFAULT_RETRY,
+        span_name="BigQuery.getTable",
+        span_attributes={"path": table_ref.path},
+        method="GET",
+        path=table_ref.path,
+        timeout=METADATA_REQUEST_TIMEOUT_SECONDS,
+        query_params={"fields": fields}
+    )
+    return bigquery.Table.from_api_repr(api_response)
+
+_disk_cache_conn: Optional[sqlite3.Connection] = None
+_disk_cache_lock = threading.Lock()
+
+def _disk_cache_connection() -> sqlite3.Connection:
+    """Open (once) the metadata disk cache; callers hold _disk_cache_lock"""
+    global _disk_cache_conn
+    if _disk_cache_conn is None:
+        conn = sqlite3.connect(METADATA_DISK_CACHE_PATH, timeout=5, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS table_metadata "
+            "(table_path TEXT PRIMARY KEY, modified TEXT, stored_at REAL, payload TEXT)"
+        )
+        _disk_cache_conn = conn
+    return _disk_cache_conn
+
+def _disk_cache_get(table_path: str) -> Optional[Tuple[str, str]]:
+    """Return (modified, metadata_json) stored for a table within BQ_META_TTL_SEC"""
+    try:
+        with _disk_cache_lock:
+            return _disk_cache_connection().execute(
+                "SELECT modified, payload FROM table_metadata WHERE table_path = ? AND stored_at > ?",
+                (table_path, time.time() - BQ_META_TTL_SEC)
+            ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning("Could not read metadata disk cache: %s", e)
+        return None
+
+def _disk_cache_put(table_path: str, modified: str, payload: str):
+    """Store a table's metadata JSON and drop entries past BQ_META_TTL_SEC"""
+    now = time.time()
+    try:
+        with _disk_cache_lock:
+            conn = _disk_cache_connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO table_metadata VALUES (?, ?, ?, ?)",
+                    (table_path, modified, now, payload)
+                )
+                conn.execute("DELETE FROM table_metadata WHERE stored_at <= ?", (now - BQ_META_TTL_SEC,))
+    except sqlite3.Error as e:
+        logger.warning("Could not write metadata disk cache: %s", e)
+
+# One client per project, shared by the whole process: each client owns its HTTP
+# session and connection pool, which are expensive to rebuild per call. Dry runs take
+# an LLM-supplied project, so the registry is LRU-bounded and only valid ids get a client
+BQ_CLIENT_CACHE_SIZE = int(os.getenv("BQ_CLIENT_CACHE_SIZE", "8"))
+_clients: "OrderedDict[str, bigquery.Client]" = OrderedDict()
+_clients_lock = threading.Lock()
+_credentials = None
+
+def _new_client(project: str, pool_size: int) -> bigquery.Client:
+    """Create a BigQuery client whose authorized session keeps pool_size connections"""
+    global _credentials
+    if _credentials is None:
+        _credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    # Same credential refresh timeout the client uses for the session it builds itself
+    session = AuthorizedSession(_credentials, refresh_timeout=300)
+    session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    return bigquery.Client(project=project, credentials=_credentials, _http=session)
+
+def _get_shared_client(project: str) -> bigquery.Client:
+    """Get or create the process-wide BigQuery client for a project"""
+    if not _PROJECT_ID_RE.match(project):
+        raise ValueError(f"Invalid project ID: {project!r}")
+    
+    with _clients_lock:
+        client = _clients.get(project)
+        if client is None:
+            default_project = os.getenv("GOOGLE_CLOUD_PROJECT", "aiva-e74f3")
+            pool_size = BQ_HTTP_POOL_SIZE if project == default_project else BQ_OTHER_PROJECT_POOL_SIZE
+            client = _new_client(project, pool_size)
+            _clients[project] = client
+            # Evicted clients are not closed: a caller may still be using one, and
+            # its session is released once the last reference goes away
+            if len(_clients) > BQ_CLIENT_CACHE_SIZE:
+                _clients.popitem(last=False)
+        else:
+            _clients.move_to_end(project)
+    return client
+
+# Keywords that introduce a table reference; text containing none of them is not scanned
+_TABLE_KEYWORDS = ("from", "join", "into", "update", "table")
+# CTE names are referenced like tables but never exist in BigQuery
+_CTE_NAME_RE = re.compile(r'(?:\bWITH(?:\s+RECURSIVE)?|,)\s*`?(\w+)`?\s+AS\s*\(', re.IGNORECASE)
+# Keywords the scanner can pick up as a bare name (DROP TABLE IF EXISTS, FROM VALUES, ...);
+# looking them up would only cost a get_table round-trip that 404s
+_NON_TABLE_NAMES = frozenset({
+    "SELECT", "WHERE", "GROUP", "ORDER", "HAVING", "QUALIFY", "WINDOW", "WITH", "AS", "ON",
+    "USING", "UNNEST", "VALUES", "LATERAL", "UNION", "INTERSECT", "EXCEPT", "LIMIT", "IF",
+    "EXISTS", "NOT", "SET", "AND", "OR", "IN", "IS", "NULL", "BY", "FUNCTION", "TEMP", "TEMPORARY"
+})
+
+# Longest query text whose extracted table list is memoized
+EXTRACT_TABLES_CACHE_MAX_QUERY_LEN = int(os.getenv("EXTRACT_TABLES_CACHE_MAX_QUERY_LEN", "64000"))
+
+# UIs and BI tools resubmit the same SQL text, so the scan result is memoized per query
+@lru_cache(maxsize=2048)
+def _scan_table_refs(query: str) -> Tuple[str, ...]:
+    """Return the cleaned, deduplicated table references of a query in order of appearance, minus CTEs"""
+    # Substring checks are far cheaper than the scanner; non-SQL text bails out here
+    lowered = query.lower()
+    if not any(keyword in lowered for keyword in _TABLE_KEYWORDS):
+        return ()
+    
+    cte_names = {name.lower() for name in _CTE_NAME_RE.findall(query)}
+    
+    # Clean and deduplicate straight off the scanner (dict keeps first-seen order)
+    cleaned_tables = {}
+    for match in _TABLE_REF_SCAN_RE.finditer(query):
+        table = match.group("path")
+        # After FROM/JOIN a path followed by "(" is a call (UNNEST(...)), never a table;
+        # after INTO it is the column list of an INSERT target
+        if not table or (match.group("call") and match.group("keyword").upper() in ("FROM", "JOIN")):
+            continue
+        if '.' not in table and table.upper() in _NON_TABLE_NAMES:
+            continue
+        
+        # Remove backticks; wildcard tables (events_*) use % for the metadata query
+        table = table.replace('`', '').strip().replace('*', '%')
+        if table and table.lower() not in cte_names:
+            cleaned_tables[table] = None
+    
+    return tuple(cleaned_tables)
+
+# Project and dataset ids are spliced into SQL (identifiers can't be parameters), so check them first
+_SQL_IDENTIFIER_RE = re.compile(r'[A-Za-z0-9_\-]+\Z')
+
+def _validate_identifiers(*identifiers: str):
+    """Reject project/dataset ids that could break out of a backticked table path"""
+    for identifier in identifiers:
+        if not _SQL_IDENTIFIER_RE.match(identifier or ""):
+            raise ValueError(f"Invalid BigQuery identifier: {identifier!r}")
+
+def _metadata_job_config(*query_parameters) -> bigquery.QueryJobConfig:
+    """Job config for metadata lookups: parameterized so identical lookups hit the results cache"""
+    return bigquery.QueryJobConfig(
+        query_parameters=list(query_parameters),
+        use_query_cache=True,
+        maximum_bytes_billed=METADATA_QUERY_MAX_BYTES_BILLED
+    )
+
 class BigQueryMetadataTool:
     """Tool to fetch actual BigQuery table metadata"""
     
+    # Shared by all instances: canonical table path -> (expires_at, metadata_json, size_bytes, row_count)
+    # Entries are stored serialized so no caller can mutate a cached result; only
+    # successful lookups are cached so missing tables and transient errors are retried
+    _metadata_cache: "OrderedDict[str, Tuple[float, str, int, int]]" = OrderedDict()
+    _metadata_cache_lock = threading.RLock()
+    # (project, dataset) -> (expires_at, stats); errors are not cached
+    _dataset_stats_cache: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+    _dataset_stats_cache_lock = threading.Lock()
+    
     def __init__(self):
-        self.client = None
         self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT", "aiva-e74f3")
     
     def _get_client(self):
-        """Get or create BigQuery client"""
-        if not self.client:
-            self.client = bigquery.Client(project=self.project_id)
-        return self.client
+        """Get the shared BigQuery client for the default project"""
+        return _get_shared_client(self.project_id)
     
     def _extract_schema(self, schema) -> List[Dict[str, Any]]:
         """Extract schema information from BigQuery schema"""
         schema_info = []
-        for field in schema:
-            field_info = {
-                "name": field.name,
-                "type": field.field_type,
-                "mode": field.mode,
-                "description": field.description or "",
-                "is_nullable": field.mode != "REQUIRED",
-                "is_repeated": field.mode == "REPEATED"
-            }
-            
-            # Handle nested fields (RECORD type)
-            if field.field_type == "RECORD" and field.fields:
-                field_info["fields"] = self._extract_schema(field.fields)
-            
-            schema_info.append(field_info)
+        # Explicit stack of (fields, list to fill) instead of recursing into RECORDs;
+        # each list is filled by a single loop, so field order is preserved
+        stack = [(schema, schema_info)]
+        while stack:
+            fields, target = stack.pop()
+            for field in fields:
+                field_info = {
+                    "name": field.name,
+                    "type": field.field_type,
+                    "mode": field.mode,
+                    "description": field.description or "",
+                    "is_nullable": field.mode != "REQUIRED",
+                    "is_repeated": field.mode == "REPEATED"
+                }
+                target.append(field_info)
+                
+                # Handle nested fields (RECORD type)
+                if field.field_type == "RECORD" and field.fields:
+                    field_info["fields"] = []
+                    stack.append((field.fields, field_info["fields"]))
         
         return schema_info
     
     def extract_tables_from_query(self, query: str) -> List[str]:
         """Extract table references from SQL query"""
-        tables = []
+        # Very large scripts are rarely resubmitted verbatim; don't pin them in the cache
+        if len(query) >= EXTRACT_TABLES_CACHE_MAX_QUERY_LEN:
+            return list(_scan_table_refs.__wrapped__(query))
+        return list(_scan_table_refs(query))
+    
+    def get_table_metadata(self, table_ref: str) -> Dict[str, Any]:
+        """Get actual metadata for a specific table, view, or wildcard pattern (TTL cached)"""
+        # Decoded per call, so every caller gets its own copy
+        return _loads(self.get_table_metadata_json(table_ref)[0])
+    
+    def get_table_metadata_json(self, table_ref: str) -> Tuple[str, int, int, bool]:
+        """
+        Serialized get_table_metadata: (metadata_json, size_bytes, row_count, ok).
+        Cache hits return the stored JSON as-is; ok is False for uncached error results.
+        """
+        try:
+            _, project, dataset, table = _parse_table_ref(table_ref, self.project_id)
+        except ValueError as e:
+            logger.error("Skipping metadata lookup: %s", e)
+            return _dumps({"table_path": table_ref, "error": str(e), "size_gb": 0, "row_count": 0}), 0, 0, False
+        cache_key = f"{project}.{dataset}.{table}"
         
-        # Common patterns for table references
-        patterns = [
-            r'FROM\s+`?([^`\s,]+)`?',  # FROM table
-            r'JOIN\s+`?([^`\s,]+)`?',   # JOIN table
-            r'INTO\s+`?([^`\s,]+)`?',   # INSERT INTO table
-            r'UPDATE\s+`?([^`\s,]+)`?', # UPDATE table
-            r'TABLE\s+`?([^`\s,]+)`?',  # WITH table
-        ]
+        with self._metadata_cache_lock:
+            cached = self._metadata_cache.get(cache_key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._metadata_cache.move_to_end(cache_key)
+                return cached[1:] + (True,)
         
-        for pattern in patterns:
-            matches = re.findall(pattern, query, re.IGNORECASE)
-            tables.extend(matches)
+        metadata = None
+        use_disk_cache = bool(METADATA_DISK_CACHE_PATH) and '*' not in table and '%' not in table
+        if use_disk_cache:
+            metadata = self._get_table_metadata_from_disk(cache_key)
+            if metadata is not None:
+                return self._store_cached_metadata(cache_key, metadata) + (True,)
         
-        # Clean and deduplicate
-        cleaned_tables = []
-        for table in tables:
-            # Remove backticks and clean
-            table = table.replace('`', '').strip()
-            
-            # Handle wildcard tables (e.g., events_*)
-            if '*' in table:
-                table = table.replace('*', '%')  # Use % for metadata query
-            
-            if table and table not in cleaned_tables:
-                cleaned_tables.append(table)
+        metadata = self._get_table_metadata_uncached(table_ref)
+        if "error" in metadata:
+            return _dumps(metadata), metadata.get("size_bytes", 0), metadata.get("row_count", 0), False
         
-        return cleaned_tables
+        entry = self._store_cached_metadata(cache_key, metadata)
+        # Views and sharded-table fallbacks aggregate other tables, so their own
+        # lastModifiedTime can't tell whether the stored copy is still current
+        if (use_disk_cache and metadata.get("modified")
+                and metadata.get("table_type") != "VIEW" and not metadata.get("is_wildcard")):
+            _disk_cache_put(cache_key, metadata["modified"], entry[0])
+        return entry + (True,)
     
-    def get_table_metadata(self, table_ref: str) -> Dict[str, Any]:
-        """Get actual metadata for a specific table, view, or wildcard pattern"""
+    def _get_table_metadata_from_disk(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Disk-cached metadata for a table, if the table hasn't been modified since it was stored"""
+        entry = _disk_cache_get(cache_key)
+        if entry is None:
+            return None
+        
+        modified, payload = entry
+        try:
+            # Revalidate with a two-field tables.get instead of the full resource
+            table_obj = _get_table_light(self._get_client(), cache_key, fields="tableReference,lastModifiedTime")
+        except Exception as e:
+            logger.debug("Could not revalidate disk-cached metadata for %s: %s", cache_key, e)
+            return None
+        
+        if _isoformat(table_obj.modified) != modified:
+            return None
+        return _loads(payload)
+    
+    def _store_cached_metadata(self, cache_key: str, metadata: Dict[str, Any]) -> Tuple[str, int, int]:
+        """Insert a successful lookup into the shared TTL cache and return its entry"""
+        entry = (_dumps(metadata), metadata.get("size_bytes", 0), metadata.get("row_count", 0))
+        with self._metadata_cache_lock:
+            self._metadata_cache[cache_key] = (time.monotonic() + TABLE_METADATA_TTL_SECONDS,) + entry
+            self._metadata_cache.move_to_end(cache_key)
+            if len(self._metadata_cache) > TABLE_METADATA_CACHE_SIZE:
+                self._metadata_cache.popitem(last=False)
+        return entry
+    
+    def _get_table_metadata_uncached(self, table_ref: str) -> Dict[str, Any]:
+        """Fetch metadata for a table, view, or wildcard pattern from BigQuery"""
         try:
             client = self._get_client()
             
-            # Remove backticks if present
-            table_ref = table_ref.replace('`', '').strip()
-            
-            # Parse table reference
-            parts = table_ref.split('.')
-            if len(parts) == 3:
-                project, dataset, table = parts
-            elif len(parts) == 2:
-                project = self.project_id
-                dataset, table = parts
-            else:
-                project = self.project_id
-                dataset = os.getenv("BIGQUERY_DATASET", "analytics")  # Use env default
-                table = parts[0]
-            
-            # Don't modify dataset names - they can have numbers and underscores
-            # analytics_441577273 is a valid dataset name in BigQuery
-            
-            # Validate project ID - should not contain dots
-            # If project contains dots, it means we parsed incorrectly
-            if '.' in project:
-                logger.error(f"Invalid project ID '{project}' - contains dots, reparsing")
-                # This might mean the table reference was incorrectly parsed
-                # Re-parse assuming it's project.dataset.table
-                all_parts = table_ref.split('.')
-                if len(all_parts) >= 3:
-                    project = all_parts[0]
-                    dataset = all_parts[1] 
-                    table = '.'.join(all_parts[2:])  # Rest is table name
-                else:
-                    project = self.project_id
+            _, project, dataset, table = _parse_table_ref(table_ref, self.project_id)
             
             # Handle wildcard tables (e.g., events_*, events_202*)
             if '*' in table or '%' in table:
                 return self._get_wildcard_table_metadata(project, dataset, table.replace('*', '%'))
             
-            # Build full table reference
-            table_ref_full = f"{project}.{dataset}.{table}"
+            # Canonical project.dataset.table; error paths report the caller's table_ref
+            canonical_ref = f"{project}.{dataset}.{table}"
             
             # Try to get the table/view metadata
             try:
-                table_obj = client.get_table(table_ref_full)
+                table_obj = _get_table_light(client, canonical_ref)
             except NotFound:
                 # Handle table suffixes - might be a sharded table
-                if '_' in table and any(char.isdigit() for char in table.split('_')[-1]):
-                    base_table = '_'.join(table.split('_')[:-1])
-                    suffix = table.split('_')[-1]
-                    if suffix.isdigit() and len(suffix) >= 6:  # Likely a date suffix
-                        logger.info(f"Table {table} not found, checking for wildcard pattern {base_table}_*")
-                        return self._get_wildcard_table_metadata(project, dataset, f"{base_table}_%")
+                base_table, separator, suffix = table.rpartition('_')
+                if separator and suffix.isdigit() and len(suffix) >= 6:  # Likely a date suffix
+                    logger.info("Table %s not found, checking for wildcard pattern %s_*", table, base_table)
+                    return self._get_wildcard_table_metadata(project, dataset, f"{base_table}_%")
                 
                 # Table truly not found
-                raise NotFound(f"Table {table_ref_full} not found")
+                raise NotFound(f"Table {canonical_ref} not found")
             
             # Log the raw values for debugging
-            logger.info(f"Table {table_ref_full}: num_bytes={table_obj.num_bytes}, num_rows={table_obj.num_rows}")
+            logger.debug("Table %s: num_bytes=%s, num_rows=%s", canonical_ref, table_obj.num_bytes, table_obj.num_rows)
             
             # For GA4 tables and some other tables, size might not be immediately available
             # Try to get size from TABLE_STORAGE or __TABLES__ if num_bytes is None
@@ -147,28 +464,30 @@ class BigQueryMetadataTool:
             if size_bytes is None or size_bytes == 0:
                 try:
                     # Try using __TABLES__ which usually has size info
+                    # project/dataset were just resolved by get_table; the table id is a parameter
                     tables_query = f"""
                     SELECT size_bytes, row_count 
                     FROM `{project}.{dataset}.__TABLES__`
-                    WHERE table_id = '{table}'
+                    WHERE table_id = @table_id
                     """
-                    tables_result = client.query(tables_query)
+                    job_config = _metadata_job_config(bigquery.ScalarQueryParameter("table_id", "STRING", table))
+                    tables_result = client.query(tables_query, job_config=job_config)
                     for row in tables_result:
                         if row.size_bytes is not None:
                             size_bytes = row.size_bytes
-                            logger.info(f"Got size from __TABLES__: {size_bytes} bytes")
+                            logger.debug("Got size from __TABLES__: %s bytes", size_bytes)
                         if row.row_count is not None and row_count == 0:
                             row_count = row.row_count
                         break
                 except Exception as e:
-                    logger.warning(f"Could not get size from __TABLES__: {e}")
+                    logger.warning("Could not get size from __TABLES__: %s", e)
             
             # Use the size we found (or 0 if nothing worked)
             size_bytes = size_bytes or 0
             
             # Get comprehensive metadata
             metadata = {
-                "table_path": table_ref_full,
+                "table_path": canonical_ref,
                 "project": project,
                 "dataset": dataset,
                 "table_name": table,
@@ -176,8 +495,8 @@ class BigQueryMetadataTool:
                 # Size and row metrics
                 "row_count": row_count,
                 "size_bytes": size_bytes,
-                "size_gb": round(size_bytes / (1024**3), 2) if size_bytes > 0 else 0,
-                "size_mb": round(size_bytes / (1024**2), 2) if size_bytes > 0 else 0,
+                "size_gb": _round_gb(size_bytes) if size_bytes > 0 else 0,
+                "size_mb": _round_mb(size_bytes) if size_bytes > 0 else 0,
                 
                 # Partitioning information
                 "partitioned": table_obj.partitioning_type is not None,
@@ -196,15 +515,15 @@ class BigQueryMetadataTool:
                 
                 # Table properties
                 "table_type": table_obj.table_type,
-                "created": table_obj.created.isoformat() if table_obj.created else None,
-                "modified": table_obj.modified.isoformat() if table_obj.modified else None,
-                "expires": table_obj.expires.isoformat() if table_obj.expires else None,
+                "created": _isoformat(table_obj.created),
+                "modified": _isoformat(table_obj.modified),
+                "expires": _isoformat(table_obj.expires),
                 "description": table_obj.description or "",
                 "labels": table_obj.labels or {},
                 
                 # Performance hints
-                "require_partition_filter": table_obj.require_partition_filter if hasattr(table_obj, 'require_partition_filter') else False,
-                "location": table_obj.location if hasattr(table_obj, 'location') else None
+                "require_partition_filter": table_obj.require_partition_filter,
+                "location": table_obj.location
             }
             
             # For VIEWs, get the underlying table information
@@ -216,7 +535,7 @@ class BigQueryMetadataTool:
             return metadata
             
         except NotFound:
-            logger.warning(f"Table not found: {table_ref}")
+            logger.warning("Table not found: %s", table_ref)
             return {
                 "table_path": table_ref,
                 "error": "Table not found",
@@ -224,7 +543,7 @@ class BigQueryMetadataTool:
                 "row_count": 0
             }
         except Exception as e:
-            logger.error(f"Error fetching metadata for {table_ref}: {e}")
+            logger.error("Error fetching metadata for %s: %s", table_ref, e)
             return {
                 "table_path": table_ref,
                 "error": str(e),
@@ -232,27 +551,35 @@ class BigQueryMetadataTool:
                 "row_count": 0
             }
     
+    def _get_table_metadata_or_exception(self, table_ref: str) -> Tuple[Optional[Dict[str, Any]], Optional[Exception]]:
+        """get_table_metadata for view expansion: exceptions are returned instead of aborting the view"""
+        try:
+            return self.get_table_metadata(table_ref), None
+        except Exception as e:
+            return None, e
+    
     def _get_view_underlying_tables(self, view_obj, project: str, dataset: str, view_name: str) -> Dict[str, Any]:
         """Extract underlying table information from a view"""
         try:
             client = self._get_client()
             
             # Get view definition
-            view_query = view_obj.view_query if hasattr(view_obj, 'view_query') else None
+            view_query = view_obj.view_query
             
             if not view_query:
                 # Try to get view definition from INFORMATION_SCHEMA
                 query = f"""
                 SELECT view_definition 
                 FROM `{project}.{dataset}.INFORMATION_SCHEMA.VIEWS`
-                WHERE table_name = '{view_name}'
+                WHERE table_name = @view_name
                 """
+                job_config = _metadata_job_config(bigquery.ScalarQueryParameter("view_name", "STRING", view_name))
                 try:
-                    result = list(client.query(query))
+                    result = list(client.query(query, job_config=job_config))
                     if result:
                         view_query = result[0].view_definition
                 except Exception as e:
-                    logger.warning(f"Could not fetch view definition from INFORMATION_SCHEMA: {e}")
+                    logger.warning("Could not fetch view definition from INFORMATION_SCHEMA: %s", e)
                     return None
             
             if not view_query:
@@ -261,56 +588,58 @@ class BigQueryMetadataTool:
             # Extract table references from the view query
             underlying_tables = self.extract_tables_from_query(view_query)
             
-            # Get metadata for each underlying table
+            # Looked up one after another: this already runs in a metadata worker, and a pool
+            # per view (and per nested view) would multiply the thread count without bound
+            lookups = [self._get_table_metadata_or_exception(table_ref) for table_ref in underlying_tables]
+            
             underlying_metadata = []
-            total_size_gb = 0
+            total_bytes = 0
             total_rows = 0
             
-            for table_ref in underlying_tables:
-                try:
-                    # Get metadata for this underlying table
-                    table_metadata = self.get_table_metadata(table_ref)
-                    
-                    # Only include essential info to avoid recursion/bloat
-                    if "error" not in table_metadata:
-                        simplified_metadata = {
-                            "table_path": table_metadata.get("table_path"),
-                            "table_name": table_metadata.get("table_name"),
-                            "dataset": table_metadata.get("dataset"),
-                            "table_type": table_metadata.get("table_type"),
-                            "size_gb": table_metadata.get("size_gb", 0),
-                            "row_count": table_metadata.get("row_count", 0),
-                            "partitioned": table_metadata.get("partitioned", False),
-                            "partition_field": table_metadata.get("partition_field"),
-                            "clustered": table_metadata.get("clustered", False),
-                            "cluster_fields": table_metadata.get("cluster_fields", [])
-                        }
-                        underlying_metadata.append(simplified_metadata)
-                        total_size_gb += table_metadata.get("size_gb", 0)
-                        total_rows += table_metadata.get("row_count", 0)
-                except Exception as e:
-                    logger.warning(f"Could not get metadata for underlying table {table_ref}: {e}")
+            for table_ref, (table_metadata, error) in zip(underlying_tables, lookups):
+                if error is not None:
+                    logger.warning("Could not get metadata for underlying table %s: %s", table_ref, error)
                     underlying_metadata.append({
                         "table_path": table_ref,
-                        "error": str(e)
+                        "error": str(error)
                     })
-            
+                    continue
+                
+                # Only include essential info to avoid recursion/bloat
+                if "error" not in table_metadata:
+                    simplified_metadata = {
+                        "table_path": table_metadata.get("table_path"),
+                        "table_name": table_metadata.get("table_name"),
+                        "dataset": table_metadata.get("dataset"),
+                        "table_type": table_metadata.get("table_type"),
+                        "size_gb": table_metadata.get("size_gb", 0),
+                        "row_count": table_metadata.get("row_count", 0),
+                        "partitioned": table_metadata.get("partitioned", False),
+                        "partition_field": table_metadata.get("partition_field"),
+                        "clustered": table_metadata.get("clustered", False),
+                        "cluster_fields": table_metadata.get("cluster_fields", [])
+                    }
+                    underlying_metadata.append(simplified_metadata)
+                    total_bytes += table_metadata.get("size_bytes", 0)
+                    total_rows += table_metadata.get("row_count", 0)
+            
+            total_size_gb = _round_gb(total_bytes)
             return {
                 "sql": view_query[:500] + "..." if len(view_query) > 500 else view_query,  # Truncate long queries
                 "underlying_tables": underlying_metadata,
                 "underlying_tables_count": len(underlying_tables),
-                "total_underlying_size_gb": round(total_size_gb, 2),
+                "total_underlying_size_gb": total_size_gb,
                 "total_underlying_rows": total_rows,
                 "optimization_hints": [
                     "Views don't store data - query performance depends on underlying tables",
-                    f"This view queries {len(underlying_tables)} table(s) totaling {round(total_size_gb, 2)} GB",
+                    f"This view queries {len(underlying_tables)} table(s) totaling {total_size_gb} GB",
                     "Consider materializing if frequently queried with similar filters",
                     "Ensure underlying tables are properly partitioned and clustered"
                 ]
             }
             
         except Exception as e:
-            logger.warning(f"Error extracting view definition: {e}")
+            logger.warning("Error extracting view definition: %s", e)
             return None
     
     def _get_wildcard_table_metadata(self, project: str, dataset: str, table_pattern: str) -> Dict[str, Any]:
@@ -321,60 +650,33 @@ class BigQueryMetadataTool:
             # Don't modify dataset names - they are valid as-is
             # analytics_441577273 is a valid dataset name in BigQuery
             
-            # Validate project ID - should not contain dots or be a path
-            if '.' in project:
-                logger.error(f"Invalid project ID '{project}' - contains dots, using default project")
-                # This likely means we got passed something like "project.dataset" as project
-                # Use the default project ID instead
-                project = self.project_id
-            
-            # Use __TABLES__ meta-table for wildcard queries
-            # INFORMATION_SCHEMA doesn't work well with some datasets like GA4 exports
-            query = f"""
-            SELECT 
-                table_id as table_name,
-                size_bytes,
-                row_count,
-                TIMESTAMP_MILLIS(creation_time) as creation_time,
-                CASE 
-                    WHEN type = 1 THEN 'TABLE'
-                    WHEN type = 2 THEN 'VIEW'
-                    ELSE 'OTHER'
-                END as table_type
-            FROM `{project}.{dataset}.__TABLES__`
-            WHERE table_id LIKE '{table_pattern}'
-            ORDER BY table_id
-            """
-            
-            result = client.query(query)
-            
-            total_rows = 0
-            total_bytes = 0
-            table_count = 0
-            tables_list = []
+            _validate_identifiers(project, dataset)
+            job_config = _metadata_job_config(bigquery.ScalarQueryParameter("table_pattern", "STRING", table_pattern))
+            query = _WILDCARD_STATS_QUERY.format(project=project, dataset=dataset)
+            row = list(client.query(query, job_config=job_config))[0]
             
-            for row in result:
-                table_count += 1
-                total_rows += row.row_count or 0
-                total_bytes += row.size_bytes or 0
-                tables_list.append(row.table_name)
+            table_count = row.table_count or 0
+            total_rows = row.total_rows or 0
+            total_bytes = row.total_bytes or 0
+            tables_list = list(row.tables_matched or [])
             
-            # Get sample schema from first table
+            # Sample schema from the first table
             # For wildcard tables (like GA4 events_intraday_*), all tables have the same schema
             sample_schema = []
             column_names = []
+            # A free tables.get; reading INFORMATION_SCHEMA.COLUMNS instead would be a billed scan
             if tables_list:
                 try:
                     # Use the first matched table to get the schema
                     sample_table_name = tables_list[0]
-                    logger.info(f"Fetching schema from sample table: {sample_table_name}")
-                    sample_table = client.get_table(f"{project}.{dataset}.{sample_table_name}")
+                    logger.debug("Fetching schema from sample table: %s", sample_table_name)
+                    sample_table = client.get_table(f"{project}.{dataset}.{sample_table_name}", timeout=METADATA_REQUEST_TIMEOUT_SECONDS)
                     column_names = [field.name for field in sample_table.schema]
-                    # Only get limited schema details to avoid huge response
-                    sample_schema = self._extract_schema(sample_table.schema)[:20]  # Limit to 20 fields
-                    logger.info(f"Successfully fetched {len(column_names)} columns from {sample_table_name}")
+                    # Only the first 10 fields are returned, so only those are converted
+                    sample_schema = self._extract_schema(sample_table.schema[:10])
+                    logger.debug("Successfully fetched %d columns from %s", len(column_names), sample_table_name)
                 except Exception as e:
-                    logger.warning(f"Could not get schema for sample table {tables_list[0]}: {e}")
+                    logger.warning("Could not get schema for sample table %s: %s", tables_list[0], e)
             
             # For wildcard tables, we assume they're partitioned by table suffix
             # GA4 export tables are typically partitioned this way
@@ -390,19 +692,19 @@ class BigQueryMetadataTool:
                 "tables_matched": tables_list[:10],  # First 10 tables
                 "row_count": total_rows,
                 "size_bytes": total_bytes,
-                "size_gb": round(total_bytes / (1024**3), 2),
-                "size_mb": round(total_bytes / (1024**2), 2),
+                "size_gb": _round_gb(total_bytes),
+                "size_mb": _round_mb(total_bytes),
                 "partitioned": is_partitioned,
                 "partition_field": "_TABLE_SUFFIX" if is_partitioned else None,
                 "clustered": False,  # Can't determine from __TABLES__
                 "cluster_fields": [],
                 "column_names": column_names,
-                "schema": sample_schema[:10] if sample_schema else [],  # Limit schema size
+                "schema": sample_schema,  # Limited to 10 fields above
                 "column_count": len(column_names)
             }
             
         except Exception as e:
-            logger.error(f"Error fetching wildcard metadata: {e}")
+            logger.error("Error fetching wildcard metadata: %s", e)
             return {
                 "table_path": f"{project}.{dataset}.{table_pattern}",
                 "error": str(e),
@@ -410,11 +712,33 @@ class BigQueryMetadataTool:
                 "row_count": 0
             }
     
-    def get_dataset_stats(self, dataset_id: str = None) -> Dict[str, Any]:
-        """Get statistics for an entire dataset"""
+    def get_dataset_stats(self, dataset_id: str = None, force_refresh: bool = False) -> Dict[str, Any]:
+        """Get statistics for an entire dataset (cached for DATASET_STATS_TTL_SECONDS unless force_refresh)"""
+        dataset_id = dataset_id or os.getenv("BIGQUERY_DATASET", "analytics")
+        cache_key = (self.project_id, dataset_id)
+        
+        with self._dataset_stats_cache_lock:
+            cached = self._dataset_stats_cache.get(cache_key)
+            if cached is not None and cached[0] > time.monotonic() and not force_refresh:
+                self._dataset_stats_cache.move_to_end(cache_key)
+                return copy.deepcopy(cached[1])
+        
+        stats = self._get_dataset_stats_uncached(dataset_id)
+        if "error" in stats:
+            return stats
+        
+        with self._dataset_stats_cache_lock:
+            self._dataset_stats_cache[cache_key] = (time.monotonic() + DATASET_STATS_TTL_SECONDS, stats)
+            self._dataset_stats_cache.move_to_end(cache_key)
+            if len(self._dataset_stats_cache) > DATASET_STATS_CACHE_SIZE:
+                self._dataset_stats_cache.popitem(last=False)
+        return copy.deepcopy(stats)
+    
+    def _get_dataset_stats_uncached(self, dataset_id: str) -> Dict[str, Any]:
+        """Query statistics for an entire dataset"""
         try:
+            _validate_identifiers(self.project_id, dataset_id)
             client = self._get_client()
-            dataset_id = dataset_id or os.getenv("BIGQUERY_DATASET", "analytics")
             
             # Query to get dataset statistics
             query = f"""
@@ -425,45 +749,70 @@ class BigQueryMetadataTool:
                 MAX(creation_time) as latest_table_created,
                 MIN(creation_time) as oldest_table_created
             FROM `{self.project_id}.{dataset_id}`.INFORMATION_SCHEMA.TABLE_STORAGE
-            WHERE table_schema = '{dataset_id}'
+            WHERE table_schema = @dataset_id
             """
             
-            result = list(client.query(query))[0]
+            job_config = _metadata_job_config(bigquery.ScalarQueryParameter("dataset_id", "STRING", dataset_id))
+            result = list(client.query(query, job_config=job_config))[0]
             
             return {
                 "dataset": dataset_id,
                 "table_count": result.table_count or 0,
-                "total_size_gb": round((result.total_bytes or 0) / (1024**3), 2),
+                "total_size_gb": _round_gb(result.total_bytes or 0),
                 "total_rows": result.total_rows or 0,
-                "latest_table": result.latest_table_created.isoformat() if result.latest_table_created else None,
-                "oldest_table": result.oldest_table_created.isoformat() if result.oldest_table_created else None
+                "latest_table": _isoformat(result.latest_table_created),
+                "oldest_table": _isoformat(result.oldest_table_created)
             }
         except Exception as e:
-            logger.error(f"Error getting dataset stats: {e}")
+            logger.error("Error getting dataset stats: %s", e)
             return {"error": str(e)}
     
     def get_query_metadata(self, query: str) -> Dict[str, Any]:
         """Get metadata for all tables in a query"""
         tables = self.extract_tables_from_query(query)
         
-        metadata_list = []
-        total_size_gb = 0
-        total_rows = 0
+        if len(tables) > 1:
+            # Lookups are blocking REST calls; run them side by side (map keeps query order)
+            with ThreadPoolExecutor(max_workers=min(METADATA_FETCH_WORKERS, len(tables))) as executor:
+                results = list(executor.map(self.get_table_metadata, tables))
+        else:
+            results = [self.get_table_metadata(table) for table in tables]
         
-        for table in tables:
-            metadata = self.get_table_metadata(table)
-            metadata_list.append(metadata)
-            total_size_gb += metadata.get("size_gb", 0)
-            total_rows += metadata.get("row_count", 0)
+        return self._summarize_query_metadata(tables, results)
+    
+    async def aget_query_metadata(self, query: str) -> Dict[str, Any]:
+        """Async get_query_metadata: table lookups run as tasks on the caller's event loop"""
+        tables = self.extract_tables_from_query(query)
+        
+        results = await asyncio.gather(*(
+            asyncio.to_thread(self.get_table_metadata, table) for table in tables
+        ))
+        return self._summarize_query_metadata(tables, results)
+    
+    def _summarize_query_metadata(self, tables: List[str], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Combine per-table metadata into the get_query_metadata response"""
+        metadata_list = list(results)
+        # Sum exact bytes and round once, rather than adding up per-table rounded GB
+        total_size_gb = _round_gb(sum(metadata.get("size_bytes", 0) for metadata in metadata_list))
+        total_rows = sum(metadata.get("row_count", 0) for metadata in metadata_list)
         
         return {
             "tables_found": len(tables),
-            "total_size_gb": round(total_size_gb, 2),
+            "total_size_gb": total_size_gb,
             "total_row_count": total_rows,
             "tables": metadata_list,
-            "summary": f"Found {len(tables)} table(s) totaling {round(total_size_gb, 2)}GB with {total_rows:,} rows"
+            "summary": f"Found {len(tables)} table(s) totaling {total_size_gb}GB with {total_rows:,} rows"
         }
 
+_tool: Optional[BigQueryMetadataTool] = None
+
+def get_metadata_tool() -> BigQueryMetadataTool:
+    """Process-wide BigQueryMetadataTool (it holds no per-call state)"""
+    global _tool
+    if _tool is None:
+        _tool = BigQueryMetadataTool()
+    return _tool
+
 # Create functions that can be used as ADK tools
 def fetch_bigquery_metadata(query: str) -> str:
     """
@@ -475,14 +824,27 @@ def fetch_bigquery_metadata(query: str) -> str:
     Returns:
         JSON string with table metadata
     """
-    import json
-    tool = BigQueryMetadataTool()
+    tool = get_metadata_tool()
     metadata = tool.get_query_metadata(query)
-    return json.dumps(metadata, indent=2)
+    return _dumps_indented(metadata)
+
+def _get_table_metadata_json(tool: BigQueryMetadataTool, table_path: str) -> Tuple[str, int, int, bool]:
+    """Return (metadata_json, size_bytes, row_count, ok) for a table, reporting lookup errors inline"""
+    try:
+        return tool.get_table_metadata_json(table_path)
+    except Exception as e:
+        metadata = {
+            "table_path": table_path,
+            "error": str(e),
+            "size_gb": 0,
+            "row_count": 0
+        }
+        return _dumps(metadata), 0, 0, False
 
-def fetch_tables_metadata(table_paths: list[str]) -> str:
+async def fetch_tables_metadata(table_paths: list[str]) -> str:
     """
     Fetch BigQuery metadata for specific table paths.
+    Tables are looked up concurrently, so pass every table in a single call.
     
     Args:
         table_paths: List of table paths (e.g., ["project.dataset.table", "dataset.table", "table"])
@@ -490,43 +852,37 @@ def fetch_tables_metadata(table_paths: list[str]) -> str:
     Returns:
         JSON string with detailed metadata for each table
     """
-    import json
-    tool = BigQueryMetadataTool()
+    tool = get_metadata_tool()
+    
+    # BigQuery lookups are blocking I/O, so fan them out to worker threads
+    results = await asyncio.gather(*(
+        asyncio.to_thread(_get_table_metadata_json, tool, table_path)
+        for table_path in table_paths
+    ))
     
-    metadata_list = []
-    total_size_gb = 0
+    tables_json = []
+    total_bytes = 0
     total_rows = 0
     
-    for table_path in table_paths:
-        try:
-            # Get metadata for each table
-            metadata = tool.get_table_metadata(table_path)
-            
-            # Add to list even if there was an error (to show which tables couldn't be found)
-            metadata_list.append(metadata)
-            
-            # Accumulate totals only for successful fetches
-            if "error" not in metadata:
-                total_size_gb += metadata.get("size_gb", 0)
-                total_rows += metadata.get("row_count", 0)
-        except Exception as e:
-            # Add error entry for this table
-            metadata_list.append({
-                "table_path": table_path,
-                "error": str(e),
-                "size_gb": 0,
-                "row_count": 0
-            })
+    for metadata_json, size_bytes, row_count, ok in results:
+        # Add to list even if there was an error (to show which tables couldn't be found)
+        tables_json.append(metadata_json)
+        
+        # Accumulate totals only for successful fetches
+        if ok:
+            total_bytes += size_bytes
+            total_rows += row_count
     
-    result = {
+    total_size_gb = _round_gb(total_bytes)
+    header = _dumps({
         "tables_found": len(table_paths),
-        "total_size_gb": round(total_size_gb, 2),
+        "total_size_gb": total_size_gb,
         "total_row_count": total_rows,
-        "tables": metadata_list,
-        "summary": f"Found {len(table_paths)} table(s) totaling {round(total_size_gb, 2)}GB with {total_rows:,} rows"
-    }
+        "summary": f"Found {len(table_paths)} table(s) totaling {total_size_gb}GB with {total_rows:,} rows"
+    })
     
-    return json.dumps(result, indent=2)
+    # Splice the pre-serialized table entries in rather than re-encoding them
+    return f'{header[:-1]}, "tables": [{", ".join(tables_json)}]}}'
 
 def format_bytes(bytes_value: int) -> str:
     """Format bytes into human-readable string"""
@@ -564,15 +920,13 @@ def bigquery_dry_run(query: str, project_id: Optional[str] = None) -> str:
         - statement_type: Type of SQL statement
         - error_message: Error details if invalid
     """
-    import json
-    
     # Use provided project_id or fall back to environment variable
     if not project_id:
         project_id = os.getenv("GOOGLE_CLOUD_PROJECT", "aiva-e74f3")
     
     try:
-        # Create BigQuery client
-        client = bigquery.Client(project=project_id)
+        # Reuse the pooled client for this project
+        client = _get_shared_client(project_id)
         
         # Configure for dry run (no actual query execution)
         # use_query_cache=False ensures we get accurate cost estimates
@@ -599,17 +953,17 @@ def bigquery_dry_run(query: str, project_id: Optional[str] = None) -> str:
             "bytes_processed_formatted": format_bytes(query_job.total_bytes_processed or 0),
             "estimated_cost_usd": calculate_cost(query_job.total_bytes_processed or 0),
             "referenced_tables": referenced_tables,
-            "statement_type": query_job.statement_type if hasattr(query_job, 'statement_type') else "UNKNOWN",
-            "uses_legacy_sql": query_job.uses_legacy_sql if hasattr(query_job, 'uses_legacy_sql') else False,
+            "statement_type": query_job.statement_type,
+            "uses_legacy_sql": query_job.use_legacy_sql,
             "error_message": None
         }
         
-        logger.info(f"Dry run successful: {result['bytes_processed_formatted']} = ${result['estimated_cost_usd']}")
+        logger.info("Dry run successful: %s = $%s", result['bytes_processed_formatted'], result['estimated_cost_usd'])
         
     except Exception as e:
         # Build error response
         error_msg = str(e)
-        logger.error(f"Dry run failed: {error_msg}")
+        logger.error("Dry run failed: %s", error_msg)
         
         result = {
             "valid": False,
@@ -622,4 +976,4 @@ def bigquery_dry_run(query: str, project_id: Optional[str] = None) -> str:
             "error_message": error_msg
         }
     
-    return json.dumps(result, indent=2)
\ No newline at end of file
+    return _dumps_indented(result)
\ No newline at end of file
@@ -10,6 +10,12 @@ from google.cloud import bigquery
 from typing import Optional
 import json
 
+# libyaml's C emitter when available; same representers as yaml.Dumper
+try:
+    from yaml import CDumper as YamlDumper
+except ImportError:
+    from yaml import Dumper as YamlDumper
+
 logger = logging.getLogger(__name__)
 
 def fetch_rules_from_bigquery(project_id: Optional[str] = None) -> str:
@@ -82,7 +88,7 @@ def fetch_rules_from_bigquery(project_id: Optional[str] = None) -> str:
                 rules_dict['rules'].append(rule)
             
             # Convert to YAML string
-            yaml_content = yaml.dump(rules_dict, default_flow_style=False, sort_keys=False)
+            yaml_content = yaml.dump(rules_dict, Dumper=YamlDumper, default_flow_style=False, sort_keys=False)
             logger.info(f"✅ Loaded {len(results)} BigQuery anti-pattern rules from {table_id}")
             return yaml_content
             
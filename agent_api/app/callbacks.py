@@ -3,165 +3,290 @@ Streaming Callbacks for Agents
 Handles streaming output to frontend via SSE with enhanced logging
 """
 
+import re
 import json
 import logging
 import time
 from datetime import datetime
+from typing import Optional
 from google.adk.agents.callback_context import CallbackContext
+from google.genai import types
 
-# Configure detailed logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Logging is configured once by the agent entry point (app/agent.py)
 logger = logging.getLogger(__name__)
 
 from app.tracing import add_trace_event, set_trace_attribute
 
-# Global dictionary to track agent start times
+# orjson parses/serializes several times faster; fall back to stdlib json if the wheel is missing
+try:
+    import orjson
+    _loads = orjson.loads
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _loads = json.loads
+    _dumps = json.dumps
+
+_SEPARATOR = "=" * 60
+
+# Markdown code fence around model JSON output (```json ... ``` or ``` ... ```)
+_FENCE_RE = re.compile(r'\A\s*```(?:json)?\s*(.*?)\s*```\s*\Z', re.DOTALL)
+
+# Banner logged when a stage callback fires; agent_name is bound once per agent
+_CALLBACK_BANNER = (
+    _SEPARATOR + "\n"
+    "📍 CALLBACK TRIGGERED: {agent_name}\n"
+    "⏱️ Execution time: {execution_time}s\n"
+    + _SEPARATOR
+)
+
+# Global dictionary to track agent start times (time.monotonic_ns)
 agent_start_times = {}
 
-def create_streaming_callback(agent_name: str, stage_message: str, output_key: str):
-    """Creates a streaming callback for a specific agent with enhanced logging and tracing"""
+# Second-resolution ISO prefix, rebuilt only when the wall-clock second changes
+_iso_second_cache = [None, ""]
+
+def _iso_now() -> str:
+    """Local-time ISO 8601 timestamp with microseconds, same shape as datetime.now().isoformat()"""
+    ns = time.time_ns()
+    second, remainder_ns = divmod(ns, 1_000_000_000)
+    if second != _iso_second_cache[0]:
+        _iso_second_cache[1] = datetime.fromtimestamp(second).isoformat()
+        _iso_second_cache[0] = second
+    return f"{_iso_second_cache[1]}.{remainder_ns // 1000:06d}"
+
+def _metadata_metrics(data: dict) -> dict:
+    return {
+        "tables_found": data.get('tables_found', 0),
+        "total_size_gb": data.get('total_size_gb', 0)
+    }
+
+def _rules_metrics(data: dict) -> dict:
+    return {
+        "rules_checked": data.get('rules_checked', 0),
+        "violations_found": data.get('violations_found', 0)
+    }
+
+def _optimizer_metrics(data: dict) -> dict:
+    return {"total_optimizations": data.get('total_optimizations', 0)}
+
+def _report_metrics(data: dict) -> dict:
+    exec_summary = data.get('executive_summary', {})
+    return {"cost_reduction": str(exec_summary.get('cost_reduction', 'N/A'))}
+
+# Per-stage metrics extracted from parsed output for logging and tracing
+_STAGE_METRICS = {
+    "metadata_extractor": _metadata_metrics,
+    "rule_checker": _rules_metrics,
+    "query_optimizer": _optimizer_metrics,
+    "final_reporter": _report_metrics,
+}
+
+class StreamingCallback:
+    """
+    after_agent_callback for a pipeline stage with enhanced logging and tracing.
+    One class shared by every stage; per-stage values are bound once in __init__.
+    """
     
-    # Record start time when callback is created (agent starts)
-    agent_start_times[agent_name] = time.time()
+    __slots__ = ("agent_name", "stage_message", "output_key", "json_state_key", "stage_metrics",
+                 "banner", "trace_event_name", "stage_type")
     
-    def callback(callback_context: CallbackContext) -> None:
+    def __init__(self, agent_name: str, stage_message: str, output_key: str,
+                 json_state_key: Optional[str] = None):
+        self.agent_name = agent_name
+        self.stage_message = stage_message
+        self.output_key = output_key
+        # Optional state key that also receives the parsed output as a JSON string, for
+        # instructions that inject it ({key} templating renders a dict as its Python repr)
+        self.json_state_key = json_state_key
+        self.stage_metrics = _STAGE_METRICS.get(agent_name)
+        
+        # Per-agent strings are built once here instead of on every callback
+        self.banner = _CALLBACK_BANNER.replace("{agent_name}", agent_name)
+        self.trace_event_name = f"Stage completed: {agent_name}"
+        self.stage_type = agent_name.replace("_", "-")
+        
+        # Record start time when callback is created (agent starts)
+        agent_start_times[agent_name] = time.monotonic_ns()
+    
+    def __call__(self, callback_context: CallbackContext) -> None:
         """Streams output immediately after agent completes with detailed logging"""
         session = callback_context._invocation_context.session
         
         # Calculate execution time
-        end_time = time.time()
-        start_time = agent_start_times.get(agent_name, end_time)
-        execution_time = round(end_time - start_time, 2)
+        end_ns = time.monotonic_ns()
+        start_ns = agent_start_times.get(self.agent_name, end_ns)
+        execution_time = round((end_ns - start_ns) / 1e9, 2)
         
         # Add trace event for stage completion
-        add_trace_event(f"Stage completed: {agent_name}", {
-            "stage.name": agent_name,
-            "stage.message": stage_message,
-            "stage.output_key": output_key,
+        add_trace_event(self.trace_event_name, {
+            "stage.name": self.agent_name,
+            "stage.message": self.stage_message,
+            "stage.output_key": self.output_key,
             "execution_time": execution_time
         })
         
         # Enhanced logging for debugging
-        logger.info(f"=" * 60)
-        logger.info(f"📍 CALLBACK TRIGGERED: {agent_name}")
-        logger.info(f"⏱️ Execution time: {execution_time}s")
-        logger.info(f"=" * 60)
-        
-        # Log session state keys
-        logger.info(f"Session state keys: {list(session.state.keys())}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(self.banner.format_map({"execution_time": execution_time}))
         
-        # Log events count
-        logger.info(f"Total events in session: {len(session.events) if hasattr(session, 'events') else 'N/A'}")
+        # Session diagnostics build lists, so only collect them when DEBUG is on
+        log_debug = logger.isEnabledFor(logging.DEBUG)
+        if log_debug:
+            logger.debug("Session state keys: %s", list(session.state.keys()))
+            logger.debug("Total events in session: %s", len(session.events) if hasattr(session, 'events') else 'N/A')
         
         # Create a stage output
         stage_output = {
-            "stage": agent_name,
-            "timestamp": datetime.now().isoformat(),
+            "stage": self.agent_name,
+            "timestamp": _iso_now(),
             "status": "completed",
-            "message": stage_message,
+            "message": self.stage_message,
             "execution_time": execution_time
         }
         
-        # Get the output from the session state
-        if output_key in session.state:
-            stage_output["type"] = agent_name.replace("_", "-")
-            raw_output = session.state[output_key]
+        # Collected here and written to the session state once at the end
+        state_updates = {}
+        
+        # Get the output from the session state (single lookup)
+        raw_output = session.state.get(self.output_key)
+        if raw_output is not None:
+            stage_output["type"] = self.stage_type
             
-            logger.info(f"✅ Output found for key '{output_key}'")
-            logger.info(f"Output type: {type(raw_output)}")
+            logger.info("✅ Output found for key '%s'", self.output_key)
+            logger.debug("Output type: %s", type(raw_output))
             
-            # Log first 500 chars of output
-            if isinstance(raw_output, str):
-                logger.info(f"Output preview (first 500 chars): {raw_output[:500]}")
-            else:
-                logger.info(f"Output (non-string): {str(raw_output)[:500]}")
+            data = None
             
-            # Try to clean up JSON output from all agents
+            # Try to clean up JSON output from agents without an output_schema
             if isinstance(raw_output, str):
-                output_text = raw_output.strip()
-                
+                # Log first 500 chars of output
+                logger.debug("Output preview (first 500 chars): %.500s", raw_output)
                 # Remove markdown code block wrapper if present
-                if output_text.startswith('```json'):
-                    output_text = output_text[7:]  # Remove ```json
-                    logger.info("Removed ```json prefix")
-                if output_text.endswith('```'):
-                    output_text = output_text[:-3]  # Remove ```
-                    logger.info("Removed ``` suffix")
-                output_text = output_text.strip()
+                fenced = _FENCE_RE.match(raw_output)
+                output_text = fenced.group(1) if fenced else raw_output.strip()
                 
                 try:
-                    # Try to parse as JSON
-                    data = json.loads(output_text)
+                    # Try to parse as JSON (orjson raises a json.JSONDecodeError subclass)
+                    data = _loads(output_text)
+                    logger.info("✅ JSON parsed successfully for %s", self.agent_name)
+                except json.JSONDecodeError as e:
+                    logger.warning("⚠️ Could not parse JSON from %s: %s", self.agent_name, e)
+                    logger.warning("Raw text (first 200 chars): %.200s", output_text)
+            else:
+                # Agents with an output_schema already store validated dicts
+                logger.debug("Output (non-string): %.500s", raw_output)
+                data = raw_output
+            
+            if data is not None:
+                if isinstance(data, dict):
                     # Add execution time to the data
-                    if isinstance(data, dict):
-                        data['execution_time'] = execution_time
-                    # Update session state with clean JSON
-                    session.state[output_key] = data  # Store as dict, not string
-                    stage_output["data"] = data  # Add parsed data to stage output
-                    
-                    logger.info(f"✅ JSON parsed successfully for {agent_name}")
-                    logger.info(f"Parsed data keys: {list(data.keys()) if isinstance(data, dict) else 'not a dict'}")
+                    data['execution_time'] = execution_time
+                    if log_debug:
+                        logger.debug("Parsed data keys: %s", list(data.keys()))
                     
                     # Log specific details based on agent and add to trace
-                    if agent_name == "metadata_extractor" and isinstance(data, dict):
-                        tables_found = data.get('tables_found', 0)
-                        total_size = data.get('total_size_gb', 0)
-                        logger.info(f"  - Tables found: {tables_found}")
-                        logger.info(f"  - Total size: {total_size} GB")
-                        set_trace_attribute(f"{agent_name}.tables_found", tables_found)
-                        set_trace_attribute(f"{agent_name}.total_size_gb", total_size)
-                    elif agent_name == "rule_checker" and isinstance(data, dict):
-                        rules_checked = data.get('rules_checked', 0)
-                        violations = data.get('violations_found', 0)
-                        logger.info(f"  - Rules checked: {rules_checked}")
-                        logger.info(f"  - Violations: {violations}")
-                        set_trace_attribute(f"{agent_name}.rules_checked", rules_checked)
-                        set_trace_attribute(f"{agent_name}.violations_found", violations)
-                    elif agent_name == "query_optimizer" and isinstance(data, dict):
-                        optimizations = data.get('total_optimizations', 0)
-                        logger.info(f"  - Optimizations: {optimizations}")
-                        set_trace_attribute(f"{agent_name}.total_optimizations", optimizations)
-                    elif agent_name == "final_reporter" and isinstance(data, dict):
-                        exec_summary = data.get('executive_summary', {})
-                        cost_reduction = exec_summary.get('cost_reduction', 'N/A')
-                        logger.info(f"  - Cost reduction: {cost_reduction}")
-                        set_trace_attribute(f"{agent_name}.cost_reduction", str(cost_reduction))
-                        
-                except json.JSONDecodeError as e:
-                    logger.warning(f"⚠️ Could not parse JSON from {agent_name}: {e}")
-                    logger.warning(f"Raw text (first 200 chars): {output_text[:200]}")
-                    stage_output["data"] = raw_output  # Use raw text if parsing fails
-            else:
-                stage_output["data"] = raw_output
-                logger.info(f"Output is already non-string type: {type(raw_output)}")
+                    if self.stage_metrics is not None:
+                        log_metrics = logger.isEnabledFor(logging.INFO)
+                        for metric, value in self.stage_metrics(data).items():
+                            if log_metrics:
+                                logger.info("  - %s: %s", metric, value)
+                            set_trace_attribute(f"{self.agent_name}.{metric}", value)
+                else:
+                    logger.debug("Parsed data keys: not a dict")
+                
+                # Update session state with clean JSON
+                state_updates[self.output_key] = data  # Store as dict, not string
             
-            # Log the final stage output
-            logger.info(f"📤 Stage output prepared for streaming")
-            logger.info(f"Stage output keys: {list(stage_output.keys())}")
+            # Parsed data when available, raw text if parsing failed
+            stage_output["data"] = data if data is not None else raw_output
+            if self.json_state_key is not None:
+                state_updates[self.json_state_key] = _dumps(data) if data is not None else str(raw_output)
             
         else:
-            logger.warning(f"❌ No output found for {agent_name} with key '{output_key}'")
-            logger.warning(f"Available keys in session.state: {list(session.state.keys())}")
+            logger.warning("❌ No output found for %s with key '%s'", self.agent_name, self.output_key)
+            logger.warning("Available keys in session.state: %s", list(session.state.keys()))
         
-        logger.info(f"{'=' * 60}\n")
-    
-    return callback
+        # One write through the callback context records a single state delta,
+        # which ADK streams to the client right after the stage
+        state_updates["stage_output"] = stage_output
+        callback_context.state.update(state_updates)
+        logger.info("📤 Stage output streamed")
+        if log_debug:
+            logger.debug("Stage output keys: %s", list(stage_output.keys()))
+        
+        logger.info(_SEPARATOR + "\n")
 
 def create_event_logger_callback(agent_name: str):
     """Creates a callback that logs all events for debugging"""
     def callback(callback_context: CallbackContext) -> None:
         session = callback_context._invocation_context.session
-        logger.info(f"📊 EVENT LOGGER for {agent_name}")
+        logger.info("📊 EVENT LOGGER for %s", agent_name)
         
         if hasattr(session, 'events'):
             for i, event in enumerate(session.events[-5:]):  # Last 5 events
-                logger.info(f"  Event {i}: Type={getattr(event, 'type', 'unknown')}, "
-                          f"Has content={hasattr(event, 'content')}")
+                logger.info("  Event %d: Type=%s, Has content=%s",
+                            i, getattr(event, 'type', 'unknown'), hasattr(event, 'content'))
                 if hasattr(event, 'content'):
-                    content_str = str(event.content)[:100]
-                    logger.info(f"    Content preview: {content_str}")
+                    logger.info("    Content preview: %.100s", event.content)
+    
+    return callback
+
+def create_skip_validation_callback(stage_callback: StreamingCallback):
+    """
+    Creates the before_agent_callback for query_validation_agent.
+    
+    When the optimizer returned the original query unchanged and the original
+    query's dry run succeeded, there is nothing to validate, so answer with a
+    PASSED result instead of spending an LLM call and dry runs. Returning content
+    ends the invocation before after_agent_callback runs, so the stage's
+    StreamingCallback is invoked here to record its stage output and metrics.
+    Validation is the last pipeline stage, so ending the invocation is safe.
+    """
+    def callback(callback_context: CallbackContext) -> Optional[types.Content]:
+        state = callback_context.state
+        optimization = state.get("optimization_output")
+        if not isinstance(optimization, dict):
+            return None
+        
+        original_query = optimization.get("original_query") or ""
+        optimized_query = optimization.get("optimized_query") or ""
+        if not original_query or " ".join(original_query.split()) != " ".join(optimized_query.split()):
+            return None
+        
+        # An unchanged query is only known-good if its baseline dry run passed
+        original_dry_run = state.get("original_dry_run")
+        if isinstance(original_dry_run, str):
+            try:
+                original_dry_run = _loads(original_dry_run)
+            except json.JSONDecodeError:
+                original_dry_run = None
+        if not isinstance(original_dry_run, dict) or original_dry_run.get("valid") is not True:
+            return None
+        
+        logger.info("⏭️ Optimized query is unchanged, skipping %s", stage_callback.agent_name)
+        validation = {
+            "validation_status": "PASSED",
+            "validation_timestamp": _iso_now(),
+            "syntactic_validation": {
+                "status": "PASSED",
+                "message": "Optimized query is identical to the original query",
+                "dry_run_success": True,
+                "error_details": None
+            },
+            "schema_validation": {
+                "status": "PASSED",
+                "message": "Schema matches: query was not modified",
+                "column_match": True,
+                "type_match": True,
+                "differences": []
+            },
+            "execution_time": 0,
+            "validation_notes": "Validation skipped: the optimizer made no changes to the query",
+            "final_optimized_query": original_query
+        }
+        state[stage_callback.output_key] = validation
+        stage_callback(callback_context)
+        return types.Content(role="model", parts=[types.Part(text=_dumps(validation))])
     
-    return callback
\ No newline at end of file
+    return callback
@@ -4,6 +4,12 @@ Fetch BigQuery anti-pattern rules from Firestore
 import logging
 import yaml
 
+# libyaml's C emitter when available; same representers as yaml.Dumper
+try:
+    from yaml import CDumper as YamlDumper
+except ImportError:
+    from yaml import Dumper as YamlDumper
+
 logger = logging.getLogger(__name__)
 
 def fetch_rules_from_firestore(project_id='aiva-e74f3'):
@@ -61,7 +67,7 @@ def fetch_rules_from_firestore(project_id='aiva-e74f3'):
             'rules': rules
         }
         
-        yaml_content = yaml.dump(rules_dict, default_flow_style=False, sort_keys=False)
+        yaml_content = yaml.dump(rules_dict, Dumper=YamlDumper, default_flow_style=False, sort_keys=False)
         
         logger.info(f"✅ Loaded {len(rules)} rules from Firestore")
         return yaml_content
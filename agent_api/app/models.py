@@ -0,0 +1,44 @@
+"""
+Structured Output Models for Agents
+Pydantic models mirroring the JSON contracts in the agent instructions
+"""
+
+from typing import List
+from pydantic import BaseModel, ConfigDict, Field
+
+# Parsed LLM output is immutable and must match the documented schema exactly
+FROZEN_STRICT = ConfigDict(frozen=True, extra="forbid", str_strip_whitespace=True)
+
+
+class RuleViolation(BaseModel):
+    """A single anti-pattern rule that failed for a query"""
+    model_config = FROZEN_STRICT
+
+    rule_id: str
+    severity: str = Field(description="high|medium|low")
+    impact: str
+    fix: str
+
+
+class RuleCheckReport(BaseModel):
+    """Anti-pattern report produced by rule_checker (rules_output)"""
+    model_config = FROZEN_STRICT
+
+    rules_checked: int
+    violations_found: int
+    compliance_score: int
+    violations: List[RuleViolation] = Field(default_factory=list)
+    passed_rules: List[str] = Field(default_factory=list)
+    summary: str = ""
+
+
+class QueryAnalysis(RuleCheckReport):
+    """Anti-pattern analysis for one query of a batch"""
+    query_index: int = Field(description="Position of the query in the submitted batch")
+
+
+class QueryAnalysisBatch(BaseModel):
+    """Array-shaped response for a batch of queries analyzed in one call"""
+    model_config = FROZEN_STRICT
+
+    analyses: List[QueryAnalysis]
@@ -6,20 +6,23 @@ Provides custom span naming and attributes for better trace visibility
 import os
 from opentelemetry import trace
 from opentelemetry.trace import Status, StatusCode
-from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.resources import Resource
 from functools import wraps
 import json
 import hashlib
 from datetime import datetime
+import re
 
 # Initialize tracer only if tracing is enabled
 TRACE_ENABLED = os.getenv("ADK_TRACE_TO_CLOUD", "false").lower() == "true"
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT", "aiva-e74f3")
 
 if TRACE_ENABLED:
+    # The SDK and Cloud Trace exporter are only imported when tracing is on
+    from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.resources import Resource
+    
     # Create resource with service information
     resource = Resource.create({
         "service.name": "bigquery-optimizer",
@@ -50,6 +53,38 @@ def create_query_fingerprint(query: str) -> str:
     # Create a short hash
     return hashlib.md5(normalized.encode()).hexdigest()[:8]
 
+# Query feature bits collected by _scan_query_features
+HAS_SELECT_STAR = 1
+HAS_LIMIT = 2
+HAS_WHERE = 4
+HAS_JOIN = 8
+HAS_GROUP_BY = 16
+HAS_ORDER_BY = 32
+
+# One alternation scanned once; the matching group name identifies the feature
+_QUERY_FEATURE_SCAN = re.compile(
+    r"(?P<star>\*)"
+    r"|\b(?:(?P<limit>LIMIT)|(?P<where>WHERE)|(?P<join>JOIN)"
+    r"|(?P<group>GROUP\s+BY)|(?P<order>ORDER\s+BY))\b",
+    re.IGNORECASE
+)
+
+_GROUP_FEATURES = {
+    "star": HAS_SELECT_STAR,
+    "limit": HAS_LIMIT,
+    "where": HAS_WHERE,
+    "join": HAS_JOIN,
+    "group": HAS_GROUP_BY,
+    "order": HAS_ORDER_BY,
+}
+
+def _scan_query_features(query: str) -> int:
+    """Collect query characteristics as a bitmask in a single regex pass"""
+    features = 0
+    for match in _QUERY_FEATURE_SCAN.finditer(query):
+        features |= _GROUP_FEATURES[match.lastgroup]
+    return features
+
 def trace_agent(agent_name: str, stage_num: int = None):
     """
     Decorator to add tracing to agent functions
@@ -162,13 +197,13 @@ def create_optimization_trace(query: str, session_id: str = None):
         span.set_attribute("session.id", session_id)
     
     # Add query characteristics
-    query_lower = query.lower()
-    span.set_attribute("query.has_select_star", "*" in query)
-    span.set_attribute("query.has_limit", "limit" in query_lower)
-    span.set_attribute("query.has_where", "where" in query_lower)
-    span.set_attribute("query.has_join", "join" in query_lower)
-    span.set_attribute("query.has_group_by", "group by" in query_lower)
-    span.set_attribute("query.has_order_by", "order by" in query_lower)
+    features = _scan_query_features(query)
+    span.set_attribute("query.has_select_star", bool(features & HAS_SELECT_STAR))
+    span.set_attribute("query.has_limit", bool(features & HAS_LIMIT))
+    span.set_attribute("query.has_where", bool(features & HAS_WHERE))
+    span.set_attribute("query.has_join", bool(features & HAS_JOIN))
+    span.set_attribute("query.has_group_by", bool(features & HAS_GROUP_BY))
+    span.set_attribute("query.has_order_by", bool(features & HAS_ORDER_BY))
     
     return span
 
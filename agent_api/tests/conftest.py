@@ -0,0 +1,2 @@
+# test_local.py is a manual script that runs the live agent at import time
+collect_ignore = ["test_local.py"]
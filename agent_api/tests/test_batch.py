@@ -0,0 +1,71 @@
+"""
+Tests for the batch_optimize entry point (no LLM or BigQuery calls)
+"""
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("google.adk")
+
+from app import batch
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_batch_optimize_reindexes_chunks(monkeypatch):
+    monkeypatch.setattr(batch, "BATCH_SIZE", 2)
+
+    async def fake_analyze_chunk(queries, user_id):
+        return [{"query_index": index, "query": query} for index, query in enumerate(queries)]
+
+    monkeypatch.setattr(batch, "_analyze_chunk", fake_analyze_chunk)
+
+    analyses = _run(batch.batch_optimize(["q0", "q1", "q2"]))
+
+    assert [(a["query_index"], a["query"]) for a in analyses] == [(0, "q0"), (1, "q1"), (2, "q2")]
+
+
+def test_batch_optimize_reports_failed_chunk_per_query(monkeypatch):
+    monkeypatch.setattr(batch, "BATCH_SIZE", 2)
+
+    async def fake_analyze_chunk(queries, user_id):
+        if "bad" in queries:
+            raise ValueError("schema validation failed")
+        return [{"query_index": index, "query": query} for index, query in enumerate(queries)]
+
+    monkeypatch.setattr(batch, "_analyze_chunk", fake_analyze_chunk)
+
+    analyses = _run(batch.batch_optimize(["q0", "q1", "bad", "q3", "q4"]))
+
+    assert [a["query_index"] for a in analyses] == [0, 1, 2, 3, 4]
+    assert analyses[2] == {"query_index": 2, "error": "schema validation failed"}
+    assert analyses[3] == {"query_index": 3, "error": "schema validation failed"}
+    assert analyses[4]["query"] == "q4"
+
+
+def test_align_analyses_fills_missing_and_drops_duplicates():
+    analyses = [
+        {"query_index": 2, "violations_found": 1},
+        {"query_index": 0, "violations_found": 0},
+        {"query_index": 2, "violations_found": 5},
+        {"query_index": 7, "violations_found": 3},
+    ]
+
+    aligned = batch._align_analyses(analyses, 4)
+
+    assert [a["query_index"] for a in aligned] == [0, 1, 2, 3]
+    assert aligned[2]["violations_found"] == 1
+    assert "error" in aligned[1] and "error" in aligned[3]
+
+
+def test_read_queries_accepts_json_and_sql(tmp_path):
+    json_file = tmp_path / "queries.json"
+    json_file.write_text(json.dumps(["SELECT 1", " ", "SELECT 2"]))
+    sql_file = tmp_path / "queries.sql"
+    sql_file.write_text("SELECT 1;\n\nSELECT 2;\n")
+
+    assert batch._read_queries(str(json_file)) == ["SELECT 1", "SELECT 2"]
+    assert batch._read_queries(str(sql_file)) == ["SELECT 1", "SELECT 2"]
@@ -0,0 +1,157 @@
+"""
+Unit tests for app.bigquery_metadata helpers (no BigQuery calls are made)
+"""
+import json
+from collections import OrderedDict
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import bigquery
+
+from app import bigquery_metadata as bqm
+
+
+TABLE_RESOURCE = {
+    "tableReference": {"projectId": "test-project", "datasetId": "analytics", "tableId": "events"},
+    "type": "TABLE",
+    "numBytes": "2048",
+    "numRows": "10",
+}
+
+
+def test_get_table_light_matches_get_table_call_shape():
+    # _get_table_light calls the private Client._call_api; it must send exactly what
+    # client.get_table sends, plus the fields mask
+    client = bigquery.Client(project="test-project", credentials=AnonymousCredentials())
+    with mock.patch.object(client, "_call_api", return_value=TABLE_RESOURCE) as call_api:
+        client.get_table("test-project.analytics.events", timeout=bqm.METADATA_REQUEST_TIMEOUT_SECONDS)
+        expected = call_api.call_args
+        table = bqm._get_table_light(client, "test-project.analytics.events", fields="numRows")
+        actual = call_api.call_args
+
+    assert actual.args == expected.args
+    assert actual.kwargs == {**expected.kwargs, "query_params": {"fields": "numRows"}}
+    assert table.num_rows == 10
+    assert table.table_id == "events"
+
+
+def test_bigquery_dry_run_reads_query_job(monkeypatch):
+    client = bigquery.Client(project="test-project", credentials=AnonymousCredentials())
+    query_job = bigquery.QueryJob.from_api_repr({
+        "jobReference": {"projectId": "test-project", "jobId": "dry-run"},
+        "configuration": {"query": {"query": "SELECT id FROM ds.t", "useLegacySql": False}, "dryRun": True},
+        "statistics": {"query": {
+            "totalBytesProcessed": "1048576",
+            "statementType": "SELECT",
+            "referencedTables": [{"projectId": "test-project", "datasetId": "ds", "tableId": "t"}],
+        }},
+    }, client)
+    monkeypatch.setattr(client, "query", mock.Mock(return_value=query_job))
+    monkeypatch.setattr(bqm, "_get_shared_client", lambda project: client)
+
+    result = json.loads(bqm.bigquery_dry_run("SELECT id FROM ds.t", "test-project"))
+
+    assert result["valid"] is True, result["error_message"]
+    assert result["bytes_processed"] == 1048576
+    assert result["referenced_tables"] == ["test-project.ds.t"]
+    assert (result["statement_type"], result["uses_legacy_sql"]) == ("SELECT", False)
+
+
+@pytest.mark.parametrize("query, expected", [
+    # CTE names are not tables
+    ("WITH recent AS (SELECT * FROM `p-proj.ds.events`) SELECT * FROM recent JOIN ds.users u ON true",
+     ("p-proj.ds.events", "ds.users")),
+    # Keywords inside comments and string literals are ignored; wildcards become %
+    ("-- FROM commented.out\nSELECT 'FROM in.string' AS s, /* JOIN block.comment */ x "
+     "FROM `my-project.analytics.events_*`",
+     ("my-project.analytics.events_%",)),
+    # Backticks per path segment are removed; UNNEST(...) is a call, not a table
+    ("SELECT * FROM `my-project`.`analytics`.`events` t JOIN UNNEST(t.items) i",
+     ("my-project.analytics.events",)),
+    # An INSERT column list does not make the target a call
+    ("INSERT INTO ds.target (a, b) SELECT a, b FROM ds.src", ("ds.target", "ds.src")),
+    ("INSERT INTO `p-proj.ds.t`(a) VALUES (1)", ("p-proj.ds.t",)),
+    # Repeated references are reported once
+    ("SELECT * FROM a.b JOIN a.b USING (id)", ("a.b",)),
+    ("SELECT 1", ()),
+])
+def test_scan_table_refs(query, expected):
+    assert bqm._scan_table_refs(query) == expected
+
+
+def test_parse_table_ref_fills_defaults():
+    assert bqm._parse_table_ref("`my-project.ds.t`", "default-proj") == ("my-project.ds.t", "my-project", "ds", "t")
+    assert bqm._parse_table_ref("ds.t", "default-proj") == ("ds.t", "default-proj", "ds", "t")
+
+
+def test_parse_table_ref_rejects_invalid_project():
+    with pytest.raises(ValueError):
+        bqm._parse_table_ref("Bad_Project.ds.t", "default-proj")
+
+
+def test_get_shared_client_rejects_invalid_project():
+    with pytest.raises(ValueError):
+        bqm._get_shared_client("x; DROP")
+
+
+@pytest.fixture
+def metadata_tool(monkeypatch):
+    monkeypatch.setattr(bqm, "METADATA_DISK_CACHE_PATH", "")
+    monkeypatch.setattr(bqm.BigQueryMetadataTool, "_metadata_cache", OrderedDict())
+    tool = bqm.BigQueryMetadataTool()
+    tool.project_id = "test-project"
+    lookups = []
+
+    def fake_uncached(table_ref):
+        lookups.append(table_ref)
+        if table_ref.endswith("missing"):
+            return {"table_name": table_ref, "error": "Not found"}
+        return {"table_name": table_ref, "size_bytes": 2048, "row_count": 10, "schema": [{"name": "id"}]}
+
+    monkeypatch.setattr(tool, "_get_table_metadata_uncached", fake_uncached)
+    tool.lookups = lookups
+    return tool
+
+
+def test_metadata_cache_returns_copies(metadata_tool):
+    first = metadata_tool.get_table_metadata("analytics.events")
+    first["schema"].append({"name": "mutated"})
+    second = metadata_tool.get_table_metadata("analytics.events")
+
+    assert metadata_tool.lookups == ["analytics.events"]
+    assert second["schema"] == [{"name": "id"}]
+
+
+def test_metadata_cache_skips_errors(metadata_tool):
+    _, _, _, ok = metadata_tool.get_table_metadata_json("analytics.missing")
+    metadata_tool.get_table_metadata_json("analytics.missing")
+
+    assert not ok
+    assert metadata_tool.lookups == ["analytics.missing", "analytics.missing"]
+
+
+def test_metadata_lookup_reports_invalid_project(metadata_tool):
+    metadata = metadata_tool.get_table_metadata("Bad_Project.analytics.events")
+
+    assert "Invalid project ID" in metadata["error"]
+    assert metadata_tool.lookups == []
+
+
+def test_metadata_cache_expires(metadata_tool, monkeypatch):
+    monkeypatch.setattr(bqm, "TABLE_METADATA_TTL_SECONDS", 0)
+    metadata_tool.get_table_metadata("analytics.events")
+    metadata_tool.get_table_metadata("analytics.events")
+
+    assert metadata_tool.lookups == ["analytics.events", "analytics.events"]
+
+
+def test_metadata_cache_evicts_oldest(metadata_tool, monkeypatch):
+    monkeypatch.setattr(bqm, "TABLE_METADATA_CACHE_SIZE", 1)
+    metadata_tool.get_table_metadata("analytics.events")
+    metadata_tool.get_table_metadata("analytics.users")
+
+    assert list(metadata_tool._metadata_cache) == ["test-project.analytics.users"]
@@ -0,0 +1,85 @@
+"""
+Tests for the validation skip callback and the pipeline replay cache (no LLM or BigQuery calls)
+"""
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("google.adk")
+
+from app import agent
+from app.callbacks import create_skip_validation_callback
+
+
+def _skip_callback_run(state):
+    stage_callback = mock.Mock(agent_name="query_validation_agent", output_key="validation_output")
+    callback_context = SimpleNamespace(state=state)
+    content = create_skip_validation_callback(stage_callback)(callback_context)
+    return content, stage_callback
+
+
+def test_skip_validation_when_query_unchanged_and_dry_run_passed():
+    state = {
+        "optimization_output": {"original_query": "SELECT  a\nFROM t", "optimized_query": "SELECT a FROM t"},
+        "original_dry_run": json.dumps({"valid": True}),
+    }
+
+    content, stage_callback = _skip_callback_run(state)
+
+    assert json.loads(content.parts[0].text)["validation_status"] == "PASSED"
+    assert state["validation_output"]["final_optimized_query"] == "SELECT  a\nFROM t"
+    stage_callback.assert_called_once()
+
+
+@pytest.mark.parametrize("state", [
+    # The optimizer changed the query
+    {"optimization_output": {"original_query": "SELECT a FROM t", "optimized_query": "SELECT a FROM t LIMIT 1"},
+     "original_dry_run": {"valid": True}},
+    # The original query never passed a dry run
+    {"optimization_output": {"original_query": "SELECT a FROM t", "optimized_query": "SELECT a FROM t"},
+     "original_dry_run": {"valid": False}},
+    # The optimizer output could not be parsed
+    {"optimization_output": "not json", "original_dry_run": {"valid": True}},
+])
+def test_skip_validation_runs_validation_otherwise(state):
+    content, stage_callback = _skip_callback_run(state)
+
+    assert content is None
+    assert "validation_output" not in state
+    stage_callback.assert_not_called()
+
+
+def test_pipeline_cache_key_normalizes_defaults():
+    key = agent._pipeline_cache_key({"query": "SELECT 1"})
+
+    assert agent._pipeline_cache_key({"query": "  SELECT 1\n", "project_id": agent.PROJECT_ID}) == key
+    assert agent._pipeline_cache_key({"query": "SELECT 1", "validate": False}) != key
+    assert agent._pipeline_cache_key({"query": "SELECT 2"}) != key
+
+
+def test_pipeline_cache_expires(monkeypatch):
+    monkeypatch.setattr(agent, "_pipeline_cache", agent.OrderedDict())
+    agent._pipeline_cache["fresh"] = (agent.time.monotonic() + 60, {"stage": {}})
+    agent._pipeline_cache["stale"] = (agent.time.monotonic() - 1, {"stage": {}})
+
+    assert agent._cached_pipeline_outputs("fresh") == {"stage": {}}
+    assert agent._cached_pipeline_outputs("stale") is None
+
+
+def test_replay_emits_one_event_per_stage_with_copied_deltas():
+    stage_deltas = {
+        stage_name: {output_key: {"stage": stage_name}, "stage_output": {"items": [stage_name]}}
+        for stage_name, output_key in agent._PIPELINE_STAGE_OUTPUTS
+    }
+    ctx = SimpleNamespace(invocation_id="inv-1", branch=None)
+
+    events = list(agent.CachedSequentialAgent._replay(None, ctx, stage_deltas))
+
+    assert [event.author for event in events] == [stage_name for stage_name, _ in agent._PIPELINE_STAGE_OUTPUTS]
+    for event, (stage_name, output_key) in zip(events, agent._PIPELINE_STAGE_OUTPUTS):
+        assert event.actions.state_delta == stage_deltas[stage_name]
+        assert json.loads(event.content.parts[0].text) == {"stage": stage_name}
+        event.actions.state_delta["stage_output"]["items"].append("mutated")
+        assert stage_deltas[stage_name]["stage_output"]["items"] == [stage_name]
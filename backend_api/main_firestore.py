@@ -13,6 +13,7 @@ from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import hashlib
 import re
+from functools import lru_cache
 import json
 import os
 import time
@@ -163,28 +164,46 @@ class AnalysisResult(BaseModel):
     user_id: Optional[str] = None
 
 # Helper functions
+# SQL normalization patterns, compiled once at import
+_LINE_COMMENT_RE = re.compile(r'--.*$', re.MULTILINE)
+_BLOCK_COMMENT_RE = re.compile(r'/\*[\s\S]*?\*/')
+_SINGLE_QUOTED_RE = re.compile(r"'[^']*'")
+# Double-quoted literals and numbers never overlap, so they share one pass
+_DOUBLE_QUOTED_OR_NUMBER_RE = re.compile(r'"[^"]*"|\b\d+\.?\d*\b')
+_DATE_CALL_RE = re.compile(r'(DATE|TIMESTAMP)\s*\([^)]+\)', re.IGNORECASE)
+# Fully qualified `project.dataset.table` after FROM, used when a job has no referenced_tables
+_FROM_TABLE_RE = re.compile(r'FROM\s+`?([a-zA-Z0-9_-]+)\.([a-zA-Z0-9_-]+)\.([a-zA-Z0-9_-]+)`?', re.IGNORECASE)
+
+# Scheduled/dashboard jobs repeat the same SQL text many times per scan window.
+# The cache pins each key, so very large statements are normalized uncached
+NORMALIZE_SQL_CACHE_SIZE = int(os.getenv('NORMALIZE_SQL_CACHE_SIZE', '1024'))
+NORMALIZE_SQL_CACHE_MAX_QUERY_LEN = int(os.getenv('NORMALIZE_SQL_CACHE_MAX_QUERY_LEN', '16000'))
+
 def normalize_sql_pattern(sql: str) -> str:
     """Normalize SQL to create a pattern by replacing literals"""
     if not sql:
         return ""
+    if len(sql) >= NORMALIZE_SQL_CACHE_MAX_QUERY_LEN:
+        return _normalize_sql_pattern.__wrapped__(sql)
+    return _normalize_sql_pattern(sql)
+
+@lru_cache(maxsize=NORMALIZE_SQL_CACHE_SIZE)
+def _normalize_sql_pattern(sql: str) -> str:
+    """normalize_sql_pattern body, memoized for statements under the length cap"""
     
     # Remove comments
-    normalized = re.sub(r'--.*$', '', sql, flags=re.MULTILINE)
-    normalized = re.sub(r'/\*[\s\S]*?\*/', '', normalized)
+    normalized = _LINE_COMMENT_RE.sub('', sql)
+    normalized = _BLOCK_COMMENT_RE.sub('', normalized)
     
     # Normalize whitespace
     normalized = ' '.join(normalized.split())
     
-    # Replace string literals
-    normalized = re.sub(r"'[^']*'", '?', normalized)
-    normalized = re.sub(r'"[^"]*"', '?', normalized)
-    
-    # Replace numbers
-    normalized = re.sub(r'\b\d+\.?\d*\b', '?', normalized)
+    # Replace string literals and numbers
+    normalized = _SINGLE_QUOTED_RE.sub('?', normalized)
+    normalized = _DOUBLE_QUOTED_OR_NUMBER_RE.sub('?', normalized)
     
     # Replace date/timestamp literals
-    normalized = re.sub(r'DATE\s*\([^)]+\)', 'DATE(?)', normalized, flags=re.IGNORECASE)
-    normalized = re.sub(r'TIMESTAMP\s*\([^)]+\)', 'TIMESTAMP(?)', normalized, flags=re.IGNORECASE)
+    normalized = _DATE_CALL_RE.sub(r'\1(?)', normalized)
     
     return normalized.upper().strip()
 
@@ -210,8 +229,7 @@ def extract_tables_from_query(query_text: str, referenced_tables: str) -> List[s
     
     # Fallback to regex extraction if no referenced_tables
     if not tables and query_text:
-        pattern = r'FROM\s+`?([a-zA-Z0-9_-]+)\.([a-zA-Z0-9_-]+)\.([a-zA-Z0-9_-]+)`?'
-        matches = re.findall(pattern, query_text, re.IGNORECASE)
+        matches = _FROM_TABLE_RE.findall(query_text)
         for match in matches:
             tables.append(f"{match[1]}.{match[2]}")
     
@@ -766,10 +784,39 @@ async def get_template_analysis(project_id: str, template_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 # Rules Management Endpoints
+
+# Rules list and its docId index cached per ruleset version; every rule
+# mutation bumps the version. Writes from other instances or scripts do not
+# bump it, so entries also expire after RULES_CACHE_TTL_SEC.
+RULES_CACHE_TTL_SEC = float(os.getenv('RULES_CACHE_TTL_SEC', '30'))
+_rules_version = 0
+_rules_cache: Optional[tuple] = None
+
+
+def _invalidate_rules_cache():
+    """Bump the ruleset version so the next GET /api/rules reloads from Firestore"""
+    global _rules_version
+    _rules_version += 1
+
+
+def _rules_cache_fresh() -> bool:
+    """True if the cached rules match the current version and have not expired"""
+    return (
+        _rules_cache is not None
+        and _rules_cache[0] == _rules_version
+        and time.monotonic() < _rules_cache[1]
+    )
+
+
 @app.get("/api/rules")
 async def get_all_rules():
     """Get all BigQuery anti-pattern rules from Firestore"""
+    global _rules_cache
+    if _rules_cache_fresh():
+        return _rules_cache[2]
+    
     try:
+        version = _rules_version
         rules = []
         # Use the db directly from firestore module
         from google.cloud import firestore as fs
@@ -787,7 +834,13 @@ async def get_all_rules():
         
         # Sort rules by order if available, otherwise by title
         rules.sort(key=lambda x: (x.get('order', 999), x.get('title', '')))
-        return rules
+        _rules_cache = (
+            version,
+            time.monotonic() + RULES_CACHE_TTL_SEC,
+            tuple(rules),
+            {rule['docId']: rule for rule in rules},
+        )
+        return _rules_cache[2]
     except Exception as e:
         logger.error(f"Error fetching rules: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -795,6 +848,9 @@ async def get_all_rules():
 @app.get("/api/rules/{rule_id}")
 async def get_rule(rule_id: str):
     """Get a specific rule by ID"""
+    if _rules_cache_fresh() and rule_id in _rules_cache[3]:
+        return _rules_cache[3][rule_id]
+    
     try:
         from google.cloud import firestore as fs
         db = fs.Client(project=Config.GCP_PROJECT_ID)
@@ -827,6 +883,7 @@ async def toggle_rule(rule_id: str, enabled: bool = Body(...)):
             'enabled': enabled,
             'updated_at': datetime.utcnow().isoformat()
         })
+        _invalidate_rules_cache()
         
         return {"success": True, "message": f"Rule {rule_id} {'enabled' if enabled else 'disabled'}"}
     except Exception as e:
@@ -863,6 +920,7 @@ async def create_rule(rule: Dict[str, Any] = Body(...)):
         }
         
         doc_ref.set(rule_data)
+        _invalidate_rules_cache()
         rule_data['docId'] = rule_id
         return rule_data
     except Exception as e:
@@ -895,6 +953,7 @@ async def update_rule(rule_id: str, rule: Dict[str, Any] = Body(...)):
         update_data = {k: v for k, v in update_data.items() if v is not None}
         
         doc_ref.update(update_data)
+        _invalidate_rules_cache()
         
         updated_doc = doc_ref.get()
         rule_data = updated_doc.to_dict()
@@ -916,6 +975,7 @@ async def delete_rule(rule_id: str):
             raise HTTPException(status_code=404, detail="Rule not found")
         
         doc_ref.delete()
+        _invalidate_rules_cache()
         return {"success": True, "message": f"Rule {rule_id} deleted"}
     except Exception as e:
         logger.error(f"Error deleting rule {rule_id}: {str(e)}")